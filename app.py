@@ -1,6 +1,8 @@
 # app.py
 import streamlit as st
 import requests
+import time
+import json
 
 API_URL = "https://no-code-ai-agent-builder.onrender.com"
 
@@ -13,6 +15,8 @@ if "user" not in st.session_state:
     st.session_state.user = None
 if "agents" not in st.session_state:
     st.session_state.agents = []
+if "agent_cursors" not in st.session_state:
+    st.session_state.agent_cursors = [None]  # after_id of each page visited so far
 if "current_agent" not in st.session_state:
     st.session_state.current_agent = None
 if "chat_history" not in st.session_state:
@@ -32,9 +36,32 @@ with st.sidebar:
             st.session_state.user = None
             st.session_state.page = "login"
             st.session_state.chat_history = []
+            st.session_state.agent_cursors = [None]
     else:
         st.markdown("Welcome! Please log in or register.")
 
+AGENTS_PAGE_SIZE = 25
+
+@st.cache_resource
+def agent_page_etags():
+    # (user_id, after_id) -> (etag, page), so a refetch can be answered with a 304
+    return {}
+
+@st.cache_data(ttl=60, show_spinner=False)
+def fetch_agents_page(user_id, after_id=None):
+    key = (user_id, after_id)
+    previous = agent_page_etags().get(key)
+    headers = {"If-None-Match": previous[0]} if previous else {}
+    params = {"limit": AGENTS_PAGE_SIZE}
+    if after_id is not None:
+        params["after_id"] = after_id
+    resp = requests.get(f"{API_URL}/agents/{user_id}", params=params, headers=headers)
+    if resp.status_code == 304 and previous:
+        return previous[1]
+    page = resp.json()
+    agent_page_etags()[key] = (resp.headers.get("ETag"), page)
+    return page
+
 # --- Pages ---
 def register_page():
     st.title("📝 Register")
@@ -77,8 +104,9 @@ def login_page():
 def dashboard_page():
     st.title("🤖 Your AI Agents")
     user_id = st.session_state.user["id"]
-    resp = requests.get(f"{API_URL}/agents/{user_id}")
-    st.session_state.agents = resp.json()
+    cursors = st.session_state.agent_cursors
+    page = fetch_agents_page(user_id, cursors[-1])
+    st.session_state.agents = page["items"]
     st.markdown("### 👇 Select an agent to test or upload knowledge base:")
     for agent in st.session_state.agents:
         with st.container():
@@ -94,6 +122,15 @@ def dashboard_page():
                 if st.button("📄 Upload KB", key=f"upload_{agent['id']}"):
                     st.session_state.current_agent = agent
                     st.session_state.page = "upload_kb"
+    nav = st.columns([1, 1, 4])
+    with nav[0]:
+        if len(cursors) > 1 and st.button("⬅️ Previous"):
+            cursors.pop()
+            st.rerun()
+    with nav[1]:
+        if page["next_after_id"] is not None and st.button("Next ➡️"):
+            cursors.append(page["next_after_id"])
+            st.rerun()
     st.markdown("---")
     if st.button("➕ Create New Agent"):
         st.session_state.page = "create_agent"
@@ -105,6 +142,12 @@ def create_agent_page():
         purpose = st.text_area("Purpose")
         tone = st.selectbox("Tone", ["Professional", "Friendly", "Humorous", "Direct", "Empathetic"])
         fallback_message = st.text_input("Fallback Message", value="I'm sorry, I cannot answer that based on my current knowledge.")
+        cache_responses = st.checkbox("Cache answers to repeated questions", value=False)
+        with st.expander("Advanced retrieval settings"):
+            retrieval_k = st.number_input("Chunks per answer", min_value=1, max_value=50, value=4)
+            dense_weight = st.number_input("Semantic search weight", min_value=0.0, value=1.0, step=0.1)
+            sparse_weight = st.number_input("Keyword search weight", min_value=0.0, value=1.0, step=0.1)
+            max_context_tokens = st.number_input("Max context tokens", min_value=100, max_value=100000, value=2000, step=100)
         submitted = st.form_submit_button("Save Agent")
         if submitted:
             user_id = st.session_state.user["id"]
@@ -112,36 +155,87 @@ def create_agent_page():
                 "name": name,
                 "purpose": purpose,
                 "tone": tone,
-                "fallback_message": fallback_message
+                "fallback_message": fallback_message,
+                "cache_responses": cache_responses,
+                "retrieval_k": retrieval_k,
+                "dense_weight": dense_weight,
+                "sparse_weight": sparse_weight,
+                "max_context_tokens": max_context_tokens
             }
             resp = requests.post(f"{API_URL}/agent", params={"user_id": user_id}, json=payload)
             if resp.status_code == 200:
                 st.success("✅ Agent created!")
+                fetch_agents_page.clear()
                 st.session_state.page = "dashboard"
             else:
                 st.error("❌ " + resp.json().get("detail", "Failed to create agent."))
     if st.button("Back to Dashboard"):
         st.session_state.page = "dashboard"
 
+def wait_for_job(job_id):
+    progress = st.progress(0.0, text="Processing knowledge base...")
+    while True:
+        job = requests.get(f"{API_URL}/jobs/{job_id}").json()
+        if job.get("status") in ("completed", "failed") or "job_id" not in job:
+            progress.empty()
+            return job
+        if job["pages_parsed"] < job["pages_total"]:
+            # Chunks are embedded while later pages are still being parsed
+            text = f"Read {job['pages_parsed']}/{job['pages_total']} pages, embedded {job['chunks_embedded']} chunks"
+            fraction = job["pages_parsed"] / job["pages_total"]
+        elif job["chunks_total"]:
+            text = f"Embedded {job['chunks_embedded']}/{job['chunks_total']} chunks from {job['pages_parsed']} pages"
+            fraction = job["chunks_embedded"] / job["chunks_total"]
+        else:
+            text, fraction = None, None
+        if text:
+            if job["eta_seconds"] is not None:
+                text += f" (~{job['eta_seconds']:.0f}s left)"
+            progress.progress(fraction, text=text)
+        time.sleep(1)
+
 def upload_kb_page():
     agent = st.session_state.current_agent
     st.title(f"📄 Upload Knowledge Base for {agent['name']}")
     uploaded_file = st.file_uploader("Upload a TXT or PDF file", type=["txt", "pdf"])
     if uploaded_file is not None:
         files = {"file": (uploaded_file.name, uploaded_file.getvalue())}
-        with st.spinner("Processing knowledge base..."):
+        with st.spinner("Uploading knowledge base..."):
             resp = requests.post(
                 f"{API_URL}/upload_kb/",
                 params={"agent_id": agent["id"]},
                 files=files
             )
-        if resp.status_code == 200 and resp.json().get("status") == "success":
-            st.success("✅ Knowledge base uploaded and processed!")
+        if resp.status_code == 200 and resp.json().get("job_id"):
+            job = wait_for_job(resp.json()["job_id"])
+            if job.get("status") == "completed":
+                st.success("✅ Knowledge base uploaded and processed!")
+            else:
+                st.error("❌ " + (job.get("error") or "Processing failed."))
         else:
             st.error("❌ " + resp.json().get("detail", "Upload failed."))
     if st.button("Back to Dashboard"):
         st.session_state.page = "dashboard"
 
+def stream_answer(payload):
+    # Yields tokens from the server-sent events of /chat/stream as they arrive
+    with requests.post(f"{API_URL}/chat/stream", json=payload, stream=True) as resp:
+        if resp.status_code != 200:
+            yield "❌ " + resp.json().get("detail", "Error from agent.")
+            return
+        event = None
+        for line in resp.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):])
+                if event == "error":
+                    yield "❌ " + data.get("detail", "Error from agent.")
+                elif event != "done":
+                    yield data["token"]
+            elif not line:
+                event = None
+
 def chat_page():
     agent = st.session_state.current_agent
     st.title(f"💬 Chat with {agent['name']}")
@@ -155,19 +249,12 @@ def chat_page():
         with st.chat_message("user"):
             st.markdown(user_query)
         with st.chat_message("assistant"):
-            with st.spinner("Agent is thinking..."):
-                payload = {
-                    "agent_id": agent["id"],
-                    "agent_config": agent,
-                    "user_query": user_query
-                }
-                resp = requests.post(f"{API_URL}/chat", json=payload)
-                if resp.status_code == 200:
-                    answer = resp.json()["response"]
-                else:
-                    answer = "❌ " + resp.json().get("detail", "Error from agent.")
-                st.markdown(answer)
-                st.session_state.chat_history.append({"role": "assistant", "content": answer})
+            payload = {
+                "agent_id": agent["id"],
+                "user_query": user_query
+            }
+            answer = st.write_stream(stream_answer(payload))
+            st.session_state.chat_history.append({"role": "assistant", "content": answer})
     if st.button("Back to Dashboard"):
         st.session_state.page = "dashboard"
         st.session_state.chat_history = []
@@ -181,9 +268,8 @@ def hosted_chat_page():
         return
 
     # Fetch agent config from backend
-    resp = requests.get(f"{API_URL}/agents/{st.session_state.user['id']}" if st.session_state.user else f"{API_URL}/agents/0")
-    agents = resp.json() if resp.status_code == 200 else []
-    agent = next((a for a in agents if str(a["id"]) == str(agent_id)), None)
+    resp = requests.get(f"{API_URL}/agent/{agent_id}")
+    agent = resp.json() if resp.status_code == 200 else None
     if not agent:
         st.error("Agent not found.")
         return
@@ -201,19 +287,12 @@ def hosted_chat_page():
         with st.chat_message("user"):
             st.markdown(user_query)
         with st.chat_message("assistant"):
-            with st.spinner("Agent is thinking..."):
-                payload = {
-                    "agent_id": agent["id"],
-                    "agent_config": agent,
-                    "user_query": user_query
-                }
-                resp = requests.post(f"{API_URL}/chat", json=payload)
-                if resp.status_code == 200:
-                    answer = resp.json()["response"]
-                else:
-                    answer = "❌ " + resp.json().get("detail", "Error from agent.")
-                st.markdown(answer)
-                st.session_state[f"hosted_chat_history_{agent_id}"].append({"role": "assistant", "content": answer})
+            payload = {
+                "agent_id": agent["id"],
+                "user_query": user_query
+            }
+            answer = st.write_stream(stream_answer(payload))
+            st.session_state[f"hosted_chat_history_{agent_id}"].append({"role": "assistant", "content": answer})
 
 # --- Page Routing ---
 query_params = st.query_params
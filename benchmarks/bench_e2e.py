@@ -0,0 +1,274 @@
+"""End-to-end ingestion and /chat throughput against an in-process app.
+
+Runs the FastAPI app on a temporary SQLite database with the fake model
+backends, so numbers reflect this code (parsing, splitting, Chroma, retrieval,
+prompt assembly) rather than the provider. Ingestion uploads synthetic PDF and
+TXT files of increasing size, each to a fresh agent, and reports pages/sec and
+chunks/sec. /chat is then loaded at each concurrency level against the largest
+knowledge base and reports p50/p95/p99 latency and requests/sec. Peak RSS of
+the app process and of each parse worker is recorded after each phase.
+
+    python benchmarks/bench_e2e.py --output bench_e2e.json
+    python benchmarks/bench_e2e.py --pages 10,100,500 --concurrency 1,16,64 --chat-requests 1000
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+WORDS = (
+    "widget order return refund shipping warranty invoice customer account battery "
+    "charger cable colour size model serial delivery warehouse discount policy support"
+).split()
+LINE_CHARS = 90
+LINES_PER_PAGE = 40
+
+
+def synthetic_pages(pages: int, seed: int) -> list:
+    """Deterministic pseudo-prose, one list of lines per page; each seed gives new text."""
+    rng = random.Random(seed)
+    result = []
+    for _ in range(pages):
+        lines = []
+        for _ in range(LINES_PER_PAGE):
+            words, length = [], 0
+            while length < LINE_CHARS:
+                word = f"SKU-{rng.randrange(10000):04d}" if rng.random() < 0.05 else rng.choice(WORDS)
+                words.append(word)
+                length += len(word) + 1
+            lines.append(" ".join(words).capitalize() + ".")
+        result.append(lines)
+    return result
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages: list):
+    """Writes a minimal valid PDF: one Helvetica text stream per page."""
+    objects = {1: b"<< /Type /Catalog /Pages 2 0 R >>", 3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"}
+    page_ids = []
+    for i, lines in enumerate(pages):
+        content_id, page_id = 4 + 2 * i, 5 + 2 * i
+        text = " ".join(f"({_pdf_escape(line)}) Tj T*" for line in lines)
+        stream = f"BT /F1 9 Tf 11 TL 36 800 Td {text} ET".encode("latin-1")
+        objects[content_id] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        objects[page_id] = (
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(page_id)
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids).encode()
+    objects[2] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for obj_id in sorted(objects):
+        offsets[obj_id] = len(out)
+        out += b"%d 0 obj\n%s\nendobj\n" % (obj_id, objects[obj_id])
+    xref_offset = len(out)
+    size = max(objects) + 1
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % size
+    for obj_id in range(1, size):
+        out += b"%010d 00000 n \n" % offsets[obj_id]
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref_offset)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def write_txt(path: str, pages: list):
+    with open(path, "w") as f:
+        f.write("\n\n".join("\n".join(lines) for lines in pages))
+
+
+def _process_peak_rss_kb(pid: int):
+    # VmHWM is the process's peak resident set; Linux only
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_mb(parse_pool) -> dict:
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    to_mb = 1024 * 1024 if sys.platform == "darwin" else 1024
+    workers = [_process_peak_rss_kb(pid) for pid in (parse_pool._processes or {})]
+    return {
+        "app": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / to_mb, 1),
+        "parse_workers": [round(kb / 1024, 1) for kb in workers if kb is not None],
+    }
+
+
+def percentiles(latencies: list) -> dict:
+    latencies = sorted(latencies)
+
+    def pick(q):
+        return round(latencies[max(0, int(round(q * len(latencies))) - 1)] * 1000, 2)
+
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": round(latencies[-1] * 1000, 2)}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(__file__), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def create_agent(client, user_id: int, name: str) -> int:
+    agent = {"name": name, "purpose": "benchmarks", "tone": "Direct", "fallback_message": "n/a"}
+    resp = await client.post("/agent", params={"user_id": user_id}, json=agent)
+    resp.raise_for_status()
+    return resp.json()["id"]
+
+
+async def ingest(client, agent_id: int, path: str, pages: int) -> dict:
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        resp = await client.post("/upload_kb/", params={"agent_id": agent_id}, files={"file": (os.path.basename(path), f)})
+    resp.raise_for_status()
+    job_id = resp.json()["job_id"]
+    while True:
+        job = (await client.get(f"/jobs/{job_id}")).json()
+        if job["status"] in ("completed", "failed"):
+            break
+        await asyncio.sleep(0.02)
+    seconds = time.perf_counter() - start
+    if job["status"] != "completed":
+        raise RuntimeError(f"Ingestion of {path} failed: {job['error']}")
+    return {
+        "file_bytes": os.path.getsize(path),
+        # Text files are parsed in TXT_SECTION_BYTES sections, so pages_parsed counts those; rates use the synthetic page count
+        "pages_parsed": job["pages_parsed"],
+        "chunks": job["chunks_total"],
+        "seconds": round(seconds, 3),
+        "pages_per_sec": round(pages / seconds, 2),
+        "chunks_per_sec": round(job["chunks_total"] / seconds, 2),
+    }
+
+
+async def load_chat(client, agent_id: int, requests: int, concurrency: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    queries = [f"{rng.choice(WORDS)} {rng.choice(WORDS)} SKU-{rng.randrange(10000):04d}" for _ in range(requests)]
+    latencies, errors = [], 0
+    next_query = iter(queries)
+
+    async def worker():
+        nonlocal errors
+        for query in next_query:
+            sent = time.perf_counter()
+            resp = await client.post("/chat", json={"agent_id": agent_id, "user_query": query})
+            if resp.status_code == 200:
+                latencies.append(time.perf_counter() - sent)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    seconds = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "rps": round(len(latencies) / seconds, 2),
+        **percentiles(latencies),
+    }
+
+
+async def run(args):
+    import httpx
+    import main
+
+    await main.on_startup()
+    parse_pool = main.llm_service._parse_pool
+
+    results = {"ingestion": [], "chat": []}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+        credentials = {"email": "bench@example.com", "password": "correct horse battery staple"}
+        (await client.post("/register", json=credentials)).raise_for_status()
+        user_id = (await client.post("/login", json=credentials)).json()["id"]
+
+        # One warm-up upload so process-pool start-up isn't billed to the first size
+        warmup = os.path.join(args.workdir, "warmup.txt")
+        write_txt(warmup, synthetic_pages(1, seed=0))
+        await ingest(client, await create_agent(client, user_id, "warmup"), warmup, pages=1)
+
+        chat_agent_id = None
+        for seed, pages in enumerate(args.pages, start=1):
+            for kind in args.formats:
+                path = os.path.join(args.workdir, f"kb_{pages}p.{kind}")
+                content = synthetic_pages(pages, seed=seed * 10 + (kind == "pdf"))
+                (write_pdf if kind == "pdf" else write_txt)(path, content)
+                agent_id = await create_agent(client, user_id, f"{kind}-{pages}")
+                stats = await ingest(client, agent_id, path, pages)
+                results["ingestion"].append({"format": kind, "pages": pages, **stats, "peak_rss_mb": peak_rss_mb(parse_pool)})
+                print(f"ingest {kind:>3} {pages:>5} pages: {stats['pages_per_sec']} pages/s, {stats['chunks_per_sec']} chunks/s", file=sys.stderr)
+                chat_agent_id = agent_id
+
+        for level, concurrency in enumerate(args.concurrency):
+            stats = await load_chat(client, chat_agent_id, args.chat_requests, concurrency, seed=level)
+            results["chat"].append({**stats, "peak_rss_mb": peak_rss_mb(parse_pool)})
+            print(f"chat c={concurrency:>3}: {stats['rps']} rps, p99 {stats['p99_ms']} ms", file=sys.stderr)
+
+    results["peak_rss_mb"] = peak_rss_mb(parse_pool)
+    main.password_hasher.shutdown()
+    main.llm_service.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", default="5,25,100", help="Comma-separated synthetic document sizes, in pages")
+    parser.add_argument("--formats", default="pdf,txt", help="Comma-separated subset of pdf,txt")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated /chat concurrency levels")
+    parser.add_argument("--chat-requests", type=int, default=300, help="/chat requests per concurrency level")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+    args.pages = [int(value) for value in args.pages.split(",")]
+    args.formats = [value.strip() for value in args.formats.split(",")]
+    args.concurrency = [int(value) for value in args.concurrency.split(",")]
+
+    workdir = args.workdir = tempfile.mkdtemp(prefix="bench_e2e_")
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embedding_cache.sqlite3")
+    # Agents start without a knowledge base, whatever is already on this host
+    os.environ["VECTOR_STORE_DIR"] = os.path.join(workdir, "chroma_db")
+    os.environ["VECTOR_STORE_ARCHIVE_DIR"] = os.path.join(workdir, "kb_archive")
+    # Offline models: no key, no network, deterministic answers
+    os.environ.setdefault("MODEL_BACKEND", "fake")
+    # Access logs for every request would swamp the results on stderr
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    results = {
+        "benchmark": "e2e",
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "model_backend": os.environ["MODEL_BACKEND"],
+        "chat_requests": args.chat_requests,
+        **asyncio.run(run(args)),
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
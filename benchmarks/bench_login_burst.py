@@ -0,0 +1,147 @@
+"""/chat latency while a burst of logins runs, against an in-process app.
+
+Samples /chat latency (for an agent without a knowledge base, so the request
+only exercises the event loop and the config lookup) first while idle, then
+during a burst of concurrent logins. With --mode inline bcrypt runs directly
+in the handler, as before the password pool, for comparison. Logins that
+raise inside the app (pool timeouts while inline bcrypt blocks the loop) are
+counted under the exception's name.
+
+    python benchmarks/bench_login_burst.py --logins 200
+    python benchmarks/bench_login_burst.py --logins 200 --mode inline
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+class InlineHasher:
+    """The pre-pool behaviour: bcrypt on the event loop thread."""
+
+    def __init__(self, pwd_context):
+        self.pwd_context = pwd_context
+
+    async def hash(self, password):
+        return self.pwd_context.hash(password)
+
+    async def verify(self, password, hashed_password):
+        return self.pwd_context.verify(password, hashed_password)
+
+    def stats(self):
+        return {}
+
+    def shutdown(self):
+        pass
+
+
+def summarize(latencies: list) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "samples": len(latencies),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+    }
+
+
+async def sample_chat(client, agent_id: int, stop: asyncio.Event, latencies: list, interval: float = 0.01):
+    # Latency is measured from the scheduled send time, so time spent waiting for a
+    # blocked event loop counts (no coordinated omission).
+    loop = asyncio.get_running_loop()
+    scheduled = loop.time()
+    while not stop.is_set():
+        await asyncio.sleep(max(0.0, scheduled - loop.time()))
+        resp = await client.post("/chat", json={"agent_id": agent_id, "user_query": "hello"})
+        resp.raise_for_status()
+        latencies.append(loop.time() - scheduled)
+        scheduled = max(scheduled + interval, loop.time())
+
+
+async def run(args):
+    import httpx
+    import main
+
+    if args.mode == "inline":
+        main.password_hasher = InlineHasher(main.pwd_context)
+    await main.on_startup()
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        credentials = {"email": "bench@example.com", "password": "correct horse battery staple"}
+        (await client.post("/register", json=credentials)).raise_for_status()
+        user_id = (await client.post("/login", json=credentials)).json()["id"]
+        agent = {"name": "Bench", "purpose": "benchmarks", "tone": "Direct", "fallback_message": "n/a"}
+        agent_id = (await client.post("/agent", params={"user_id": user_id}, json=agent)).json()["id"]
+
+        idle = []
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_chat(client, agent_id, stop, idle))
+        await asyncio.sleep(args.idle_seconds)
+        stop.set()
+        await sampler
+
+        during = []
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_chat(client, agent_id, stop, during))
+        start = time.perf_counter()
+        # The in-process transport raises the app's errors (such as a pool timeout) instead of returning a 500
+        responses = await asyncio.gather(
+            *(client.post("/login", json=credentials) for _ in range(args.logins)), return_exceptions=True
+        )
+        burst_seconds = time.perf_counter() - start
+        stop.set()
+        await sampler
+
+    main.password_hasher.shutdown()
+    main.llm_service.shutdown()
+    status_counts = {}
+    for resp in responses:
+        status = type(resp).__name__ if isinstance(resp, Exception) else str(resp.status_code)
+        status_counts[status] = status_counts.get(status, 0) + 1
+    return {
+        "benchmark": "login_burst",
+        "mode": args.mode,
+        "logins": args.logins,
+        "login_status_counts": status_counts,
+        "successful_logins_per_sec": round(status_counts.get("200", 0) / burst_seconds, 2),
+        "burst_seconds": round(burst_seconds, 3),
+        "chat_latency_idle": summarize(idle),
+        "chat_latency_during_burst": summarize(during),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--idle-seconds", type=float, default=2.0)
+    parser.add_argument("--mode", choices=["pool", "inline"], default="pool")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    workdir = args.workdir = tempfile.mkdtemp(prefix="bench_login_")
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embedding_cache.sqlite3")
+    # Agents start without a knowledge base, whatever is already on this host
+    os.environ["VECTOR_STORE_DIR"] = os.path.join(workdir, "chroma_db")
+    os.environ["VECTOR_STORE_ARCHIVE_DIR"] = os.path.join(workdir, "kb_archive")
+    # Offline models: no key, no network, deterministic answers
+    os.environ.setdefault("MODEL_BACKEND", "fake")
+    # Access logs for every request would swamp the results on stderr
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Per-request CPU time of prompt assembly, before and after the prompt cache.
+
+"legacy" repeats what get_agent_response used to do on every message: build the
+ChatPromptTemplate, escape every config field and compose prompt | llm.
+"cached" is the current path: a PromptCache lookup for the compiled chain.
+Both then render the prompt messages for the request.
+
+    python benchmarks/bench_prompt_assembly.py --iterations 5000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from langchain.prompts import ChatPromptTemplate
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from services.prompt_cache import PromptCache
+
+AGENT_CONFIG = {
+    "name": "Acme {Widgets}",
+    "purpose": "answer questions about Acme products, orders and returns",
+    "tone": "Friendly",
+    "fallback_message": "I'm sorry, I cannot answer that based on my current knowledge.",
+}
+CONTEXT = "\n".join(f"SKU-{i:04d} is a widget in colour {i % 7} and size {i % 5}." for i in range(40))
+QUERY = "What colour is SKU-0012?"
+
+
+def _escape_braces(text):
+    if not isinstance(text, str):
+        return text
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+def legacy_assembly(llm):
+    system_prompt_template = (
+        "You are a helpful AI assistant for the brand \"{brand_name}\".\n"
+        "Your purpose is: {purpose}.\n"
+        "Maintain a {tone} tone in all your responses.\n"
+        "Answer questions based ONLY on the provided context. If you cannot find the answer in the context,\n"
+        "politely state that you don't have enough information and provide the fallback message: \"{fallback_message}\".\n\n"
+        "Context:\n"
+        "{context}"
+    )
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", system_prompt_template),
+        ("human", "{input}"),
+    ])
+    prompt_vars = {
+        "brand_name": _escape_braces(AGENT_CONFIG.get("name", "your brand")),
+        "purpose": _escape_braces(AGENT_CONFIG.get("purpose", "answer questions")),
+        "tone": _escape_braces(AGENT_CONFIG.get("tone", "neutral")),
+        "fallback_message": _escape_braces(AGENT_CONFIG.get("fallback_message")),
+        "context": CONTEXT,
+        "input": QUERY,
+    }
+    chain = prompt | llm
+    return chain.first.invoke(prompt_vars)
+
+
+def cached_assembly(llm, prompt_cache):
+    chain = prompt_cache.get_chain(1, AGENT_CONFIG, llm)
+    return chain.first.invoke({"context": CONTEXT, "input": QUERY})
+
+
+def measure(fn, iterations: int) -> float:
+    for _ in range(min(100, iterations)):
+        fn()
+    start = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    llm = FakeListChatModel(responses=["ok"])
+    prompt_cache = PromptCache()
+    legacy = measure(lambda: legacy_assembly(llm), args.iterations)
+    cached = measure(lambda: cached_assembly(llm, prompt_cache), args.iterations)
+
+    results = {
+        "benchmark": "prompt_assembly",
+        "iterations": args.iterations,
+        "legacy_cpu_us_per_request": round(legacy * 1e6, 2),
+        "cached_cpu_us_per_request": round(cached * 1e6, 2),
+        "speedup": round(legacy / cached, 2) if cached else None,
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Cold-start cost of the API: import time and time to first healthy response.
+
+Each run starts a fresh interpreter. Import time is what `python -X importtime
+-c "import main"` reports for main, and the slowest modules of the last run
+are listed. The app is then served by uvicorn in a new process, and the
+benchmark records how long it takes from launch until /health, /ready and
+warmed-up models (the background warm-up reported by /ready) first succeed.
+The app runs on a temporary SQLite database with the fake model backends
+unless MODEL_BACKEND says otherwise.
+
+    python benchmarks/bench_startup.py --output bench_startup.json
+    python benchmarks/bench_startup.py --runs 10 --port 8765
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+_IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure_import(env: dict) -> dict:
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    wall = time.perf_counter() - start
+    modules = []
+    for line in result.stderr.splitlines():
+        match = _IMPORT_TIME_LINE.match(line)
+        if match:
+            modules.append((match.group(4), int(match.group(2)), len(match.group(3)) // 2))
+    main_us = next(cumulative for name, cumulative, _ in modules if name == "main")
+    # Top-level packages and main's direct imports, the ones worth deferring
+    slowest = sorted((m for m in modules if m[2] <= 2), key=lambda m: m[1], reverse=True)[:15]
+    return {
+        "import_main_seconds": main_us / 1e6,
+        "process_seconds": wall,
+        "slowest_imports": [{"module": name, "seconds": round(us / 1e6, 4)} for name, us, _ in slowest],
+    }
+
+
+def _get(port: int, path: str):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        return response.status, response.read()
+    except OSError:
+        return None, None
+    finally:
+        conn.close()
+
+
+def measure_serve(env: dict, port: int, timeout: float) -> dict:
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    timings = {}
+    try:
+        while len(timings) < 3:
+            elapsed = time.perf_counter() - start
+            if elapsed > timeout:
+                raise RuntimeError(f"Server not warm after {timeout} s: reached {sorted(timings)}")
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited with status {server.returncode}")
+            if "health_seconds" not in timings:
+                if _get(port, "/health")[0] == 200:
+                    timings["health_seconds"] = elapsed
+            else:
+                status, body = _get(port, "/ready")
+                if status == 200:
+                    timings.setdefault("ready_seconds", elapsed)
+                    if json.loads(body)["caches"]["models_loaded"]:
+                        timings["models_loaded_seconds"] = elapsed
+            time.sleep(0.005)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return timings
+
+
+def summarize(values: list) -> dict:
+    return {"median": round(statistics.median(values), 4), "min": round(min(values), 4), "max": round(max(values), 4)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Cold starts to measure")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the uvicorn server")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for the server to warm up")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_startup_")
+    env = dict(os.environ)
+    env.update(
+        DATABASE_URL=f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}",
+        EMBEDDING_CACHE_PATH=os.path.join(workdir, "embedding_cache.sqlite3"),
+        VECTOR_STORE_DIR=os.path.join(workdir, "chroma_db"),
+        VECTOR_STORE_ARCHIVE_DIR=os.path.join(workdir, "kb_archive"),
+        UPLOAD_DIR=os.path.join(workdir, "uploads"),
+        LOG_LEVEL="WARNING",
+        PYTHONDONTWRITEBYTECODE="1",
+    )
+    # Offline models: no key, no network
+    env.setdefault("MODEL_BACKEND", "fake")
+
+    imports, serves = [], []
+    for run in range(args.runs):
+        imports.append(measure_import(env))
+        serves.append(measure_serve(env, args.port, args.timeout))
+        print(
+            f"run {run + 1}: import {imports[-1]['import_main_seconds']:.3f} s, "
+            f"healthy {serves[-1]['health_seconds']:.3f} s, warm {serves[-1]['models_loaded_seconds']:.3f} s",
+            file=sys.stderr,
+        )
+
+    results = {
+        "benchmark": "startup",
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "model_backend": env["MODEL_BACKEND"],
+        "runs": args.runs,
+        "import_main_seconds": summarize([r["import_main_seconds"] for r in imports]),
+        "import_process_seconds": summarize([r["process_seconds"] for r in imports]),
+        "first_healthy_seconds": summarize([r["health_seconds"] for r in serves]),
+        "first_ready_seconds": summarize([r["ready_seconds"] for r in serves]),
+        "models_loaded_seconds": summarize([r["models_loaded_seconds"] for r in serves]),
+        "slowest_imports": imports[-1]["slowest_imports"],
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,46 @@
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, model_validator
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, func
 import os
+import json
+import hashlib
+import asyncio
+import logging
+import time
 
 from models import (
-    init_db, AsyncSessionLocal, User, Agent, get_password_hash, pwd_context
+    init_db, AsyncSessionLocal, User, Agent, pwd_context, db_stats, ping_db, pool_checkout_wait, statement_latency,
+    env_flag,
 )
+from services.llm_gateway import GatewayOverloaded
 from services.llm_service import llm_service
+from services.ingestion import SUPPORTED_EXTENSIONS, IngestionJobManager
+from services.agent_config_cache import AgentConfigCache
+from services.password_hashing import PasswordHasher, PasswordPoolSaturated
+from services.metrics import REGISTRY
+from services.tracing import RequestContextMiddleware, configure_logging, current_request_id
+from services.uploads import UnsupportedUploadType, UploadError, UploadTooLarge, receive_upload
+
+configure_logging(os.getenv("LOG_LEVEL", "INFO"), json_format=os.getenv("LOG_FORMAT", "json") == "json")
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
+# Entries older than the TTL are checked against the agent's config_version, so an
+# edit made through another worker is picked up within about a second
+agent_configs = AgentConfigCache(
+    max_entries=int(os.getenv("AGENT_CONFIG_CACHE_MAX_ENTRIES", "10000")),
+    ttl_seconds=float(os.getenv("AGENT_CONFIG_CACHE_TTL_SECONDS", "1")),
+    on_change=lambda agent_id: llm_service.response_cache.invalidate(agent_id),
+)
+# bcrypt costs 100-300 ms of CPU per call; keep it off the event loop
+password_hasher = PasswordHasher(
+    pwd_context,
+    max_workers=int(os.getenv("PASSWORD_HASH_WORKERS", "2")),
+    max_queue=int(os.getenv("PASSWORD_HASH_QUEUE", "16")),
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,12 +48,76 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", "Server-Timing"],
+)
+# Stage timings are cheap to collect but describe the backend; off unless asked for
+app.add_middleware(RequestContextMiddleware, server_timing=env_flag("SERVER_TIMING", False))
+
+_CACHES = {
+    "vector_store": lambda: llm_service.vector_store_cache,
+    "embeddings": lambda: llm_service.embedding_cache,
+    "responses": lambda: llm_service.response_cache,
+    "prompts": lambda: llm_service.prompt_cache,
+    "agent_configs": lambda: agent_configs,
+}
+
+def _cache_lookups() -> dict:
+    lookups = {}
+    for name, cache in _CACHES.items():
+        cache = cache()
+        if cache is None:
+            continue  # Not created yet
+        stats = cache.stats()
+        lookups[(name, "hit")] = stats["hits"]
+        lookups[(name, "miss")] = stats["misses"]
+    return lookups
+
+# Values that already live elsewhere are read when /metrics is scraped
+REGISTRY.register_callback(
+    "app_cache_lookups_total", "Cache lookups by cache and result.", "counter", _cache_lookups, labels=("cache", "result")
+)
+REGISTRY.register_callback(
+    "db_statement_seconds", "Database statement latency by SQL verb.", "histogram",
+    lambda: {(verb,): histogram for verb, histogram in statement_latency.items()}, labels=("verb",)
+)
+REGISTRY.register_callback(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled database connection.", "histogram",
+    lambda: {(): pool_checkout_wait}
+)
+REGISTRY.register_callback(
+    "kb_rehydration_seconds", "Time to unpack an archived knowledge base.", "histogram",
+    lambda: {(): llm_service.storage.rehydration_seconds}
+)
+REGISTRY.register_callback(
+    "llm_gateway_calls", "LLM calls holding a slot (active) or waiting for one (queued).", "gauge",
+    lambda: {(state,): llm_service.llm_gateway.stats()[state] for state in ("active", "queued")}, labels=("state",)
+)
+REGISTRY.register_callback(
+    "llm_gateway_events_total", "LLM gateway rejections, coalesced calls and retries.", "counter",
+    lambda: {(event,): llm_service.llm_gateway.stats()[event] for event in ("rejected", "coalesced", "retries")},
+    labels=("event",)
 )
 
 async def get_db():
     async with AsyncSessionLocal() as session:
         yield session
 
+PURPOSE_PREVIEW_CHARS = 200
+CHAT_BATCH_MAX_QUERIES = int(os.getenv("CHAT_BATCH_MAX_QUERIES", "1000"))
+CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", "8"))
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "/tmp/uploads")
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", "200")) * 1024 * 1024
+UPLOAD_FORM_OVERHEAD_BYTES = 64 * 1024  # Room for the multipart boundaries and part headers
+# 0 disables archiving; so does leaving VECTOR_STORE_ARCHIVE_DIR unset
+KB_ARCHIVE_SWEEP_SECONDS = float(os.getenv("KB_ARCHIVE_SWEEP_SECONDS", "600"))
+# Load the model clients and vector store in the background after startup rather than on the first chat
+WARM_UP_MODELS = env_flag("WARM_UP_MODELS", True)
+READY_DB_TIMEOUT_SECONDS = float(os.getenv("READY_DB_TIMEOUT_SECONDS", "2"))
+
+# Job progress is shared through the upload directory, so any worker can answer a poll
+ingestion_jobs = IngestionJobManager(llm_service, state_dir=os.path.join(UPLOAD_DIR, "jobs"))
+
 class RegisterRequest(BaseModel):
     email: str
     password: str
@@ -37,24 +131,120 @@ class AgentConfig(BaseModel):
     purpose: str
     tone: str
     fallback_message: str
+    cache_responses: bool = False
+    retrieval_k: int = Field(4, ge=1, le=50)
+    dense_weight: float = Field(1.0, ge=0)
+    sparse_weight: float = Field(1.0, ge=0)
+    max_context_tokens: int = Field(2000, ge=100, le=100000)
+
+    @model_validator(mode="after")
+    def _check_weights(self):
+        # With both at zero retrieval finds nothing and every answer has an empty context
+        if self.dense_weight <= 0 and self.sparse_weight <= 0:
+            raise ValueError("At least one of dense_weight and sparse_weight must be above zero.")
+        return self
 
 class AgentRequest(BaseModel):
     agent_id: int
-    agent_config: AgentConfig
     user_query: str
 
+class BatchChatRequest(BaseModel):
+    agent_id: int
+    queries: list[str] = Field(..., min_length=1, max_length=CHAT_BATCH_MAX_QUERIES)
+    # Concurrent LLM calls for this batch; capped at CHAT_BATCH_CONCURRENCY
+    concurrency: int = Field(CHAT_BATCH_CONCURRENCY, ge=1)
+
+def _agent_config(agent: Agent) -> dict:
+    return {
+        "id": agent.id,
+        "name": agent.name,
+        "purpose": agent.purpose,
+        "tone": agent.tone,
+        "fallback_message": agent.fallback_message,
+        "cache_responses": bool(agent.cache_responses),
+        "retrieval_k": agent.retrieval_k,
+        "dense_weight": agent.dense_weight,
+        "sparse_weight": agent.sparse_weight,
+        "max_context_tokens": agent.max_context_tokens,
+        "config_version": agent.config_version,
+    }
+
+async def _load_agent_config(agent_id: int):
+    async with AsyncSessionLocal() as session:
+        agent = await session.get(Agent, agent_id)
+        return _agent_config(agent) if agent else None
+
+async def _load_agent_config_version(agent_id: int):
+    async with AsyncSessionLocal() as session:
+        return await session.scalar(select(Agent.config_version).where(Agent.id == agent_id))
+
+async def get_agent_config(agent_id: int) -> dict:
+    # Served from the in-process cache; only misses and version checks touch the database
+    config = await agent_configs.get(agent_id, _load_agent_config, _load_agent_config_version)
+    if config is None:
+        raise HTTPException(status_code=404, detail="Agent not found.")
+    return config
+
+async def archive_idle_stores_periodically():
+    while True:
+        await asyncio.sleep(KB_ARCHIVE_SWEEP_SECONDS)
+        try:
+            await llm_service.archive_idle_stores()
+        except Exception:
+            logger.exception("Archiving idle knowledge bases failed")
+
 @app.on_event("startup")
 async def on_startup():
     await init_db()
     os.makedirs(llm_service.base_vector_store_path, exist_ok=True)
+    if KB_ARCHIVE_SWEEP_SECONDS > 0 and llm_service.storage.enabled:
+        app.state.archive_sweeper = asyncio.create_task(archive_idle_stores_periodically())
+    elif KB_ARCHIVE_SWEEP_SECONDS > 0:
+        logger.info("Idle knowledge bases are not archived: VECTOR_STORE_ARCHIVE_DIR is not set")
+    if WARM_UP_MODELS:
+        app.state.warm_up = asyncio.create_task(warm_up_models())
+    app.state.started = True
+
+async def warm_up_models():
+    start = time.perf_counter()
+    try:
+        await asyncio.to_thread(llm_service.warm_up)
+        logger.info("Models warmed up in %.2f s", time.perf_counter() - start)
+    except Exception:
+        # Not fatal: whatever failed is retried on first use and reported there
+        logger.exception("Warming up models failed")
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    if getattr(app.state, "archive_sweeper", None):
+        app.state.archive_sweeper.cancel()
+    llm_service.shutdown()
+    password_hasher.shutdown()
+
+def _password_pool_busy():
+    return HTTPException(status_code=503, detail="Server busy, please retry.", headers={"Retry-After": "1"})
+
+def _llm_busy():
+    return HTTPException(status_code=429, detail="Too many requests to the language model, please retry.", headers={"Retry-After": "1"})
+
+def _chat_failed(e: Exception):
+    # The traceback goes to the log under the request id the client can quote
+    logger.exception("Chat request failed")
+    return HTTPException(status_code=500, detail=f"{e} (request id: {current_request_id()})")
 
 @app.post("/register")
 async def register(request: RegisterRequest, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(User).where(User.email == request.email))
+    result = await db.execute(select(User.id).where(User.email == request.email))
     existing_user = result.scalar_one_or_none()
     if existing_user:
         raise HTTPException(status_code=400, detail="User already exists.")
-    hashed_password = get_password_hash(request.password)
+    # Give the pooled connection back while the hash waits; bursts should hit the
+    # hasher's fast 503 instead of queueing every DB request behind the pool timeout
+    await db.close()
+    try:
+        hashed_password = await password_hasher.hash(request.password)
+    except PasswordPoolSaturated:
+        raise _password_pool_busy()
     new_user = User(email=request.email, hashed_password=hashed_password)
     db.add(new_user)
     await db.commit()
@@ -63,26 +253,53 @@ async def register(request: RegisterRequest, db: AsyncSession = Depends(get_db))
 
 @app.post("/login")
 async def login(request: LoginRequest, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(User).where(User.email == request.email))
-    user = result.scalar_one_or_none()
-    if user and pwd_context.verify(request.password, user.hashed_password):
-        return {"id": user.id, "email": user.email}
+    result = await db.execute(select(User.id, User.email, User.hashed_password).where(User.email == request.email))
+    user = result.one_or_none()
+    # As in register: no connection is held across the hash wait
+    await db.close()
+    if user:
+        try:
+            verified = await password_hasher.verify(request.password, user.hashed_password)
+        except PasswordPoolSaturated:
+            raise _password_pool_busy()
+        if verified:
+            return {"id": user.id, "email": user.email}
     raise HTTPException(status_code=401, detail="Invalid credentials.")
 
 @app.get("/agents/{user_id}")
-async def list_agents(user_id: int, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Agent).where(Agent.user_id == user_id))
-    agents = result.scalars().all()
-    return [
-        {
-            "id": agent.id,
-            "name": agent.name,
-            "purpose": agent.purpose,
-            "tone": agent.tone,
-            "fallback_message": agent.fallback_message,
-        }
-        for agent in agents
+async def list_agents(
+    user_id: int,
+    request: Request,
+    limit: int = Query(50, ge=1, le=200),
+    after_id: int = None,
+    db: AsyncSession = Depends(get_db)
+):
+    # Keyset pagination over the (user_id, id) index; only the columns the list shows
+    query = (
+        select(
+            Agent.id,
+            Agent.name,
+            Agent.tone,
+            func.substr(Agent.purpose, 1, PURPOSE_PREVIEW_CHARS).label("purpose"),
+        )
+        .where(Agent.user_id == user_id)
+        .order_by(Agent.id)
+        .limit(limit + 1)
+    )
+    if after_id is not None:
+        query = query.where(Agent.id > after_id)
+    rows = (await db.execute(query)).all()
+    items = [
+        {"id": row.id, "name": row.name, "purpose": row.purpose, "tone": row.tone}
+        for row in rows[:limit]
     ]
+    page = {"items": items, "next_after_id": items[-1]["id"] if len(rows) > limit else None}
+
+    body = json.dumps(page, separators=(",", ":"))
+    etag = '"' + hashlib.sha256(body.encode("utf-8")).hexdigest()[:32] + '"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
 
 @app.post("/agent")
 async def save_agent(
@@ -98,9 +315,19 @@ async def save_agent(
             db_agent.purpose = agent.purpose
             db_agent.tone = agent.tone
             db_agent.fallback_message = agent.fallback_message
+            db_agent.cache_responses = agent.cache_responses
+            db_agent.retrieval_k = agent.retrieval_k
+            db_agent.dense_weight = agent.dense_weight
+            db_agent.sparse_weight = agent.sparse_weight
+            db_agent.max_context_tokens = agent.max_context_tokens
+            # In SQL, so concurrent edits never end up on the same version
+            db_agent.config_version = Agent.config_version + 1
             db.add(db_agent)
             await db.commit()
             await db.refresh(db_agent)
+            agent_configs.put(db_agent.id, _agent_config(db_agent))
+            # Answers cached under the old config must not be served again
+            llm_service.response_cache.invalidate(db_agent.id)
             return {"id": db_agent.id}
         raise HTTPException(status_code=404, detail="Agent not found or not authorized.")
     else:
@@ -110,34 +337,214 @@ async def save_agent(
             purpose=agent.purpose,
             tone=agent.tone,
             fallback_message=agent.fallback_message,
+            cache_responses=agent.cache_responses,
+            retrieval_k=agent.retrieval_k,
+            dense_weight=agent.dense_weight,
+            sparse_weight=agent.sparse_weight,
+            max_context_tokens=agent.max_context_tokens,
         )
         db.add(new_agent)
         await db.commit()
         await db.refresh(new_agent)
+        agent_configs.put(new_agent.id, _agent_config(new_agent))
         return {"id": new_agent.id}
 
+@app.get("/agent/{agent_id}")
+async def get_agent(agent_id: int):
+    return await get_agent_config(agent_id)
+
 @app.post("/chat")
 async def chat_with_agent(request: AgentRequest):
+    agent_config = await get_agent_config(request.agent_id)
+    usage = {}
     try:
         response = await llm_service.get_agent_response(
             agent_id=request.agent_id,
-            agent_config=request.agent_config.dict(),
-            user_query=request.user_query
+            agent_config=agent_config,
+            user_query=request.user_query,
+            usage=usage
         )
-        return {"response": response}
+        return {"response": response, "usage": usage}
+    except GatewayOverloaded:
+        raise _llm_busy()
+    except Exception as e:
+        raise _chat_failed(e)
+
+def _sse(data: dict, event: str = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream")
+async def stream_chat_with_agent(request: AgentRequest):
+    agent_config = await get_agent_config(request.agent_id)
+    usage = {}
+    tokens = llm_service.stream_agent_response(
+        agent_id=request.agent_id,
+        agent_config=agent_config,
+        user_query=request.user_query,
+        usage=usage
+    )
+    # Run retrieval and wait for the first token here, so setup failures still get a 500
+    try:
+        first_token = await tokens.__anext__()
+    except StopAsyncIteration:
+        first_token = None
+    except GatewayOverloaded:
+        raise _llm_busy()
+    except Exception as e:
+        raise _chat_failed(e)
+
+    async def events():
+        if first_token is None:
+            yield _sse({"usage": usage}, event="done")
+            return
+        yield _sse({"token": first_token})
+        try:
+            async for token in tokens:
+                yield _sse({"token": token})
+            yield _sse({"usage": usage}, event="done")
+        except Exception as e:
+            logger.exception("Chat stream failed")
+            yield _sse({"detail": str(e), "request_id": current_request_id()}, event="error")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/chat/batch")
+async def batch_chat_with_agent(request: BatchChatRequest):
+    agent_config = await get_agent_config(request.agent_id)
+    results = llm_service.batch_agent_responses(
+        agent_id=request.agent_id,
+        agent_config=agent_config,
+        queries=request.queries,
+        concurrency=min(request.concurrency, CHAT_BATCH_CONCURRENCY),
+    )
+    # Embedding and retrieval run before the first result, so their failures still get a 500
+    try:
+        first_result = await results.__anext__()
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-@app.post("/upload_kb/")
-async def upload_kb(agent_id: int, file: UploadFile = File(...)):
-    upload_dir = "/tmp/uploads"
-    os.makedirs(upload_dir, exist_ok=True)
-    file_path = os.path.join(upload_dir, file.filename)
-    with open(file_path, "wb") as f:
-        f.write(await file.read())
+        raise _chat_failed(e)
+
+    async def lines():
+        # One JSON object per line, in completion order; "index" maps it back to the query
+        yield json.dumps(first_result) + "\n"
+        try:
+            async for result in results:
+                yield json.dumps(result) + "\n"
+        except Exception as e:
+            logger.exception("Chat batch failed")
+            yield json.dumps({"error": str(e), "request_id": current_request_id()}) + "\n"
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/cache_stats")
+async def cache_stats():
+    return {
+        "vector_store": llm_service.vector_store_cache.stats(),
+        "embeddings": llm_service.embedding_cache.stats() if llm_service.embedding_cache else None,
+        "responses": llm_service.response_cache.stats(),
+        "prompts": llm_service.prompt_cache.stats(),
+        "agent_configs": agent_configs.stats(),
+        "context": llm_service.context_stats,
+        "password_hashing": password_hasher.stats(),
+        "llm_gateway": llm_service.llm_gateway.stats(),
+    }
+
+@app.get("/metrics")
+async def metrics():
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/db_stats")
+async def get_db_stats():
+    return db_stats()
+
+@app.get("/health")
+async def health():
+    # Liveness only: answers as soon as the process serves HTTP, without touching the database or models
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready(response: Response):
+    # For load balancers: 503 until this worker can serve, and whenever the database or parse pool fails
+    checks = {"started": getattr(app.state, "started", False)}
+    database = {"pool": db_stats()["pool"]}
     try:
-        await llm_service.process_knowledge_base(agent_id, file_path)
-        os.remove(file_path)
-        return {"status": "success"}
+        database["ping_seconds"] = await ping_db(READY_DB_TIMEOUT_SECONDS)
+        checks["database"] = True
     except Exception as e:
-        return {"status": "error", "detail": str(e)}
+        database["error"] = str(e) or type(e).__name__
+        checks["database"] = False
+    checks["parse_pool"] = llm_service.parse_pool_healthy()
+    is_ready = all(checks.values())
+    if not is_ready:
+        response.status_code = 503
+    return {
+        "ready": is_ready,
+        "pid": os.getpid(),
+        "checks": checks,
+        "database": database,
+        # How warm this worker is; a fresh one pays cold-start costs on its first requests
+        "caches": {
+            "models_loaded": llm_service.models_loaded,
+            "vector_stores": llm_service.vector_store_cache.stats()["entries"],
+            "agent_configs": agent_configs.stats()["entries"],
+            "prompts": llm_service.prompt_cache.stats()["entries"],
+            "responses": llm_service.response_cache.stats()["entries"],
+        },
+    }
+
+@app.get("/storage_stats")
+async def get_storage_stats():
+    # Sizes come from walking the store directories, so keep it off the event loop
+    return await asyncio.to_thread(llm_service.storage.stats)
+
+# The body is read here rather than declared as an UploadFile: FastAPI would spool
+# the whole form to disk before the handler runs, so the size limit came too late
+_UPLOAD_REQUEST_BODY = {
+    "required": True,
+    "content": {
+        "multipart/form-data": {
+            "schema": {
+                "type": "object",
+                "required": ["file"],
+                "properties": {"file": {"type": "string", "format": "binary"}},
+            }
+        }
+    },
+}
+
+@app.post("/upload_kb/", openapi_extra={"requestBody": _UPLOAD_REQUEST_BODY})
+async def upload_kb(agent_id: int, request: Request):
+    too_large = f"File is larger than {UPLOAD_MAX_BYTES // (1024 * 1024)} MB."
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD_BYTES:
+        raise HTTPException(status_code=413, detail=too_large)
+    try:
+        # Written to disk as it arrives and cut off at the limit
+        file_path, filename = await receive_upload(
+            request, "file", UPLOAD_DIR, max_bytes=UPLOAD_MAX_BYTES, chunk_bytes=UPLOAD_CHUNK_BYTES,
+            extensions=SUPPORTED_EXTENSIONS,
+        )
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail=too_large)
+    except UnsupportedUploadType as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except UploadError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    # Parsing and embedding run in the background; the job deletes the file when done
+    job = ingestion_jobs.submit(agent_id, file_path, filename)
+    return {"status": job.status, "job_id": job.id}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = ingestion_jobs.get_status(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
@@ -0,0 +1,76 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class AgentConfigCache:
+    """In-process read-through cache of agent configs, keyed by agent_id.
+
+    Writers call put() after committing so this process never serves a stale
+    config. Other processes serve an entry for at most ttl_seconds before
+    checking it again. With a version_loader that check reads only the
+    agent's config_version, and the entry is reloaded only if it changed, so
+    a short TTL stays cheap. on_change(agent_id) is called when a check finds
+    the agent edited or deleted elsewhere.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 1, on_change=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.on_change = on_change
+        self._entries = OrderedDict()  # agent_id -> (config, checked_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    async def get(self, agent_id: int, loader, version_loader=None):
+        with self._lock:
+            entry = self._entries.get(agent_id)
+            if entry is not None and time.time() - entry[1] <= self.ttl_seconds:
+                self._entries.move_to_end(agent_id)
+                self.hits += 1
+                return entry[0]
+        if entry is not None and version_loader is not None:
+            version = await version_loader(agent_id)
+            if version is not None and version == entry[0].get("config_version"):
+                with self._lock:
+                    self.hits += 1
+                    self.revalidations += 1
+                self.put(agent_id, entry[0])
+                return entry[0]
+        with self._lock:
+            self.misses += 1
+        config = await loader(agent_id)
+        if config is not None:
+            self.put(agent_id, config)
+        else:
+            self.invalidate(agent_id)
+        if entry is not None and self.on_change and (
+            config is None or config.get("config_version") != entry[0].get("config_version")
+        ):
+            self.on_change(agent_id)
+        return config
+
+    def put(self, agent_id: int, config: dict):
+        with self._lock:
+            self._entries[agent_id] = (config, time.time())
+            self._entries.move_to_end(agent_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, agent_id: int):
+        with self._lock:
+            self._entries.pop(agent_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
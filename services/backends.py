@@ -0,0 +1,125 @@
+import hashlib
+import os
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from services.sparse_index import tokenize
+
+GOOGLE_EMBEDDING_MODEL = "models/text-embedding-004"
+GOOGLE_CHAT_MODEL = "gemini-1.5-flash"
+LOCAL_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+FAKE_EMBEDDING_DIMENSIONS = 256
+FAKE_LLM_RESPONSES = ["This is a canned answer from the fake language model backend."]
+
+
+class HashingEmbeddings(Embeddings):
+    """Deterministic bag-of-words vectors built with the hashing trick.
+
+    Texts sharing words get similar vectors, so retrieval behaves plausibly
+    without a model, a network call or a key.
+    """
+
+    def __init__(self, dimensions: int = FAKE_EMBEDDING_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def _embed(self, text: str) -> list:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for token in tokenize(text):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: list) -> list:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list:
+        return self._embed(text)
+
+
+def _require_api_key(api_key: str):
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY is not set in environment variables.")
+
+
+def _google_embeddings(api_key: str):
+    _require_api_key(api_key)
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    return GoogleGenerativeAIEmbeddings(model=GOOGLE_EMBEDDING_MODEL, google_api_key=api_key), GOOGLE_EMBEDDING_MODEL
+
+
+def _fake_embeddings(api_key: str):
+    return HashingEmbeddings(), f"hashing-{FAKE_EMBEDDING_DIMENSIONS}"
+
+
+def _local_embeddings(api_key: str):
+    # Optional dependency (sentence-transformers); only imported when selected
+    try:
+        from langchain_huggingface import HuggingFaceEmbeddings
+    except ImportError:
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+    model_name = os.getenv("LOCAL_EMBEDDING_MODEL", LOCAL_EMBEDDING_MODEL)
+    embeddings = HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs={"device": "cpu"},
+        encode_kwargs={"normalize_embeddings": True},
+    )
+    return embeddings, model_name
+
+
+def _google_llm(api_key: str):
+    _require_api_key(api_key)
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    # Retries are left to the gateway; the client's own retry loop sleeps on the event loop
+    return ChatGoogleGenerativeAI(model=GOOGLE_CHAT_MODEL, temperature=0.2, google_api_key=api_key, max_retries=1)
+
+
+def _fake_llm(api_key: str):
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    return FakeListChatModel(responses=FAKE_LLM_RESPONSES)
+
+
+EMBEDDING_BACKENDS = {
+    "google": _google_embeddings,
+    "fake": _fake_embeddings,
+    "local": _local_embeddings,
+}
+
+LLM_BACKENDS = {
+    "google": _google_llm,
+    "fake": _fake_llm,
+}
+
+
+def create_embeddings(backend: str, api_key: str = None):
+    """Returns (embeddings, model_name) for the named backend.
+
+    model_name keys the embedding cache, so vectors from different backends
+    never mix. A knowledge base must be queried with the backend it was built with.
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}; expected one of {sorted(EMBEDDING_BACKENDS)}.")
+    return EMBEDDING_BACKENDS[backend](api_key)
+
+
+def create_llm(backend: str, api_key: str = None):
+    if backend not in LLM_BACKENDS:
+        raise ValueError(f"Unknown LLM backend {backend!r}; expected one of {sorted(LLM_BACKENDS)}.")
+    return LLM_BACKENDS[backend](api_key)
+
+
+def retryable_errors(backend: str) -> tuple:
+    """Exceptions from the backend's client worth retrying: throttling and transient failures."""
+    if backend != "google":
+        return ()
+    from google.api_core import exceptions as google_exceptions
+    return (
+        google_exceptions.ResourceExhausted,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.DeadlineExceeded,
+        google_exceptions.InternalServerError,
+    )
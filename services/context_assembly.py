@@ -0,0 +1,92 @@
+import re
+
+from services.retrieval import estimate_tokens
+
+NEAR_DUPLICATE_JACCARD = 0.9
+MAX_MERGE_GAP = 2  # Splitters strip the whitespace between neighbouring chunks
+MIN_PARTIAL_TOKENS = 50  # Don't bother appending a truncated block smaller than this
+_WORD = re.compile(r"\w+")
+
+
+def _shingles(text: str, size: int = 3) -> set:
+    words = _WORD.findall(text.lower())
+    if len(words) < size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _merge_neighbours(ranked_docs: list) -> list:
+    """Merges overlapping or adjacent chunks of the same source into blocks.
+
+    Returns [rank, text] blocks, where rank is the best rank of the merged chunks.
+    """
+    groups, blocks = {}, []
+    for rank, doc in enumerate(ranked_docs):
+        start = doc.metadata.get("start_index")
+        if start is None:
+            # Chunks stored without offsets can't be placed; keep them as they are
+            blocks.append([rank, doc.page_content])
+            continue
+        key = (doc.metadata.get("source"), doc.metadata.get("page"))
+        groups.setdefault(key, []).append((start, rank, doc.page_content))
+
+    for spans in groups.values():
+        spans.sort()
+        block_start, block_rank, block_text = spans[0]
+        for start, rank, text in spans[1:]:
+            block_end = block_start + len(block_text)
+            if start <= block_end + MAX_MERGE_GAP:
+                if start > block_end:
+                    block_text += "\n" + text
+                elif start + len(text) > block_end:
+                    block_text += text[block_end - start:]
+                block_rank = min(block_rank, rank)
+            else:
+                blocks.append([block_rank, block_text])
+                block_start, block_rank, block_text = start, rank, text
+        blocks.append([block_rank, block_text])
+    return blocks
+
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    cut = text[:max_tokens * 4]
+    space = cut.rfind(" ")
+    return cut[:space] if space > 0 else cut
+
+
+def assemble_context(ranked_docs: list, max_tokens: int):
+    """Builds the prompt context from retrieved chunks, best first.
+
+    Overlapping or adjacent chunks from the same source are merged, near-duplicate
+    blocks are dropped and the result is cut to max_tokens. Returns (context, stats).
+    """
+    blocks = sorted(_merge_neighbours(ranked_docs), key=lambda block: block[0])
+
+    kept, kept_shingles = [], []
+    for _, text in blocks:
+        shingles = _shingles(text)
+        if any(len(shingles & other) / len(shingles | other) >= NEAR_DUPLICATE_JACCARD for other in kept_shingles):
+            continue
+        kept.append(text)
+        kept_shingles.append(shingles)
+
+    parts, used = [], 0
+    for text in kept:
+        tokens = estimate_tokens(text)
+        if used + tokens > max_tokens:
+            remaining = max_tokens - used
+            if remaining >= MIN_PARTIAL_TOKENS or not parts:
+                text = _truncate_to_tokens(text, remaining)
+                parts.append(text)
+                used += estimate_tokens(text)
+            break
+        parts.append(text)
+        used += tokens
+
+    stats = {
+        "retrieved_chunks": len(ranked_docs),
+        "retrieved_tokens": sum(estimate_tokens(doc.page_content) for doc in ranked_docs),
+        "context_blocks": len(parts),
+        "context_tokens": used,
+    }
+    return "\n\n".join(parts), stats
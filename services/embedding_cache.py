@@ -0,0 +1,224 @@
+import asyncio
+import hashlib
+import inspect
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite-backed store of embedding vectors as float32 blobs.
+
+    Keyed by (model, sha256 of text). When the stored vectors exceed max_bytes
+    the least recently used ones are evicted down to 90% of the limit. The
+    stored size is kept in the database and updated in the same transaction as
+    the vectors, so worker processes sharing the file enforce one limit. The
+    methods block on SQLite, so async callers run them in a thread.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 1024 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " hash TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " last_access REAL NOT NULL,"
+            " PRIMARY KEY (model, hash)"
+            ") WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_last_access ON embeddings (last_access)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS stored_size ("
+            " id INTEGER PRIMARY KEY CHECK (id = 0),"
+            " total_bytes INTEGER NOT NULL"
+            ")"
+        )
+        # Caches created before the size table count their vectors once
+        self._conn.execute("BEGIN IMMEDIATE")
+        self._conn.execute(
+            "INSERT OR IGNORE INTO stored_size SELECT 0, COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        )
+        self._conn.execute("COMMIT")
+        self._total_bytes = self._stored_bytes()  # As of this process's last write
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_many(self, model: str, hashes: list) -> dict:
+        if not hashes:
+            return {}
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for i in range(0, len(unique), 500):
+                batch = unique[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+                for text_hash, blob in rows:
+                    found[text_hash] = array("f", blob).tolist()
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE model = ? AND hash = ?",
+                    [(time.time(), model, text_hash) for text_hash in found],
+                )
+            self.hits += sum(1 for h in hashes if h in found)
+            self.misses += sum(1 for h in hashes if h not in found)
+        return found
+
+    def put_many(self, model: str, items: dict):
+        if not items:
+            return
+        now = time.time()
+        rows = [(model, text_hash, array("f", vector).tobytes(), now) for text_hash, vector in items.items()]
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so the size read below
+            # includes every other process's writes
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                added = 0
+                for row in rows:
+                    previous = self._conn.execute(
+                        "SELECT LENGTH(vector) FROM embeddings WHERE model = ? AND hash = ?", row[:2]
+                    ).fetchone()
+                    self._conn.execute("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", row)
+                    added += len(row[2]) - (previous[0] if previous else 0)
+                total_bytes = self._stored_bytes() + added
+                if total_bytes > self.max_bytes:
+                    total_bytes = self._evict(total_bytes, int(self.max_bytes * 0.9))
+                self._conn.execute("UPDATE stored_size SET total_bytes = ? WHERE id = 0", (total_bytes,))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._total_bytes = total_bytes
+
+    def stats(self) -> dict:
+        # Plain attribute reads, so a metrics scrape never waits behind a write
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "stored_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _stored_bytes(self) -> int:
+        return self._conn.execute("SELECT total_bytes FROM stored_size WHERE id = 0").fetchone()[0]
+
+    def _evict(self, total_bytes: int, target_bytes: int) -> int:
+        # Runs inside put_many's transaction; returns the size left
+        while total_bytes > target_bytes:
+            rows = self._conn.execute(
+                "SELECT model, hash, LENGTH(vector) FROM embeddings ORDER BY last_access LIMIT 256"
+            ).fetchall()
+            if not rows:
+                break
+            victims = []
+            for row in rows:
+                if total_bytes <= target_bytes:
+                    break
+                victims.append(row[:2])
+                total_bytes -= row[2]
+            self._conn.executemany("DELETE FROM embeddings WHERE model = ? AND hash = ?", victims)
+            self.evictions += len(victims)
+        return total_bytes
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embeddings model and serves repeated texts from an EmbeddingCache."""
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, model_name: str):
+        self.embeddings = embeddings
+        self.cache = cache
+        # Providers embed queries and documents with different task types,
+        # so the two kinds of vectors are cached separately.
+        self._document_key = f"{model_name}#document"
+        self._query_key = f"{model_name}#query"
+
+    def _lookup(self, texts: list):
+        hashes = [_text_hash(text) for text in texts]
+        found = self.cache.get_many(self._document_key, hashes)
+        missing = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in found:
+                missing.setdefault(text_hash, text)
+        return hashes, found, missing
+
+    def embed_documents(self, texts: list) -> list:
+        hashes, found, missing = self._lookup(texts)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing, vectors))
+            self.cache.put_many(self._document_key, computed)
+            found.update(computed)
+        return [found[text_hash] for text_hash in hashes]
+
+    async def aembed_documents(self, texts: list) -> list:
+        # The cache blocks on SQLite (and on ingestion's writes), so not on the event loop
+        hashes, found, missing = await asyncio.to_thread(self._lookup, texts)
+        if missing:
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            computed = dict(zip(missing, vectors))
+            await asyncio.to_thread(self.cache.put_many, self._document_key, computed)
+            found.update(computed)
+        return [found[text_hash] for text_hash in hashes]
+
+    def embed_query(self, text: str) -> list:
+        text_hash = _text_hash(text)
+        found = self.cache.get_many(self._query_key, [text_hash])
+        if text_hash in found:
+            return found[text_hash]
+        vector = self.embeddings.embed_query(text)
+        self.cache.put_many(self._query_key, {text_hash: vector})
+        return vector
+
+    async def aembed_query(self, text: str) -> list:
+        text_hash = _text_hash(text)
+        found = await asyncio.to_thread(self.cache.get_many, self._query_key, [text_hash])
+        if text_hash in found:
+            return found[text_hash]
+        vector = await self.embeddings.aembed_query(text)
+        await asyncio.to_thread(self.cache.put_many, self._query_key, {text_hash: vector})
+        return vector
+
+    async def aembed_queries(self, texts: list) -> list:
+        """Embeds many queries; the ones not cached go to the provider in one batched call."""
+        hashes = [_text_hash(text) for text in texts]
+        found = await asyncio.to_thread(self.cache.get_many, self._query_key, hashes)
+        missing = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in found:
+                missing.setdefault(text_hash, text)
+        if missing:
+            missing_texts = list(missing.values())
+            if "task_type" in inspect.signature(self.embeddings.aembed_documents).parameters:
+                # Google's batch endpoint embeds queries when told the task type
+                vectors = await self.embeddings.aembed_documents(missing_texts, task_type="RETRIEVAL_QUERY")
+            else:
+                vectors = await asyncio.gather(*(self.embeddings.aembed_query(text) for text in missing_texts))
+            computed = dict(zip(missing, vectors))
+            await asyncio.to_thread(self.cache.put_many, self._query_key, computed)
+            found.update(computed)
+        return [found[text_hash] for text_hash in hashes]
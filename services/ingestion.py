@@ -0,0 +1,231 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = (".pdf", ".txt")  # Uploads with other extensions are refused
+TXT_SECTION_BYTES = 256 * 1024  # A text file's "page" for windowed parsing
+TXT_BREAK_SEARCH_BYTES = 16 * 1024  # How far back from a section boundary to look for a break
+
+
+def count_pages(file_path: str) -> int:
+    if file_path.endswith(".pdf"):
+        from pypdf import PdfReader
+        with open(file_path, "rb") as f:
+            return len(PdfReader(f).pages)
+    if file_path.endswith(".txt"):
+        return max(1, -(-os.path.getsize(file_path) // TXT_SECTION_BYTES))
+    # Add more formats (.csv, .docx etc.) here, in iter_pages and in SUPPORTED_EXTENSIONS
+    raise ValueError("Unsupported file type for knowledge base.")
+
+
+def _txt_boundary(f, position: int, size: int) -> int:
+    # Where the section nearest position starts: after the last line break in the
+    # TXT_BREAK_SEARCH_BYTES before it, else after the last space or tab there,
+    # else at position itself. A section is therefore never longer than
+    # TXT_SECTION_BYTES + TXT_BREAK_SEARCH_BYTES, whatever the line lengths.
+    if position <= 0 or position >= size:
+        return min(max(position, 0), size)
+    window_start = max(0, position - TXT_BREAK_SEARCH_BYTES)
+    f.seek(window_start)
+    window = f.read(position - window_start + 1)  # Plus the byte at position
+    head = window[:-1]
+    for breaks in ((b"\n", b"\r"), (b" ", b"\t")):
+        cut = max(head.rfind(character) for character in breaks)
+        if cut >= 0:
+            return window_start + cut + 1
+    # A hard cut, moved back to the start of a UTF-8 character
+    cut = len(head)
+    while cut > max(0, len(head) - 3) and window[cut] & 0xC0 == 0x80:
+        cut -= 1
+    return window_start + cut
+
+
+def _read_txt_section(file_path: str, section: int) -> str:
+    # Neighbouring sections agree on the boundary between them, so they never
+    # split or share a line unless a line is too long to fit in one.
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        start = _txt_boundary(f, section * TXT_SECTION_BYTES, size)
+        end = _txt_boundary(f, (section + 1) * TXT_SECTION_BYTES, size)
+        f.seek(start)
+        data = f.read(end - start)
+    return data.decode("utf-8", errors="replace")
+
+
+def iter_pages(file_path: str, start: int, stop: int):
+    """Yields (page_number, text) for pages [start, stop), reading one page at a time."""
+    if file_path.endswith(".pdf"):
+        from pypdf import PdfReader
+        # An open file lets pypdf read just the objects these pages need
+        with open(file_path, "rb") as f:
+            reader = PdfReader(f)
+            for page_number in range(start, min(stop, len(reader.pages))):
+                yield page_number, reader.pages[page_number].extract_text().strip()
+    elif file_path.endswith(".txt"):
+        for section in range(start, stop):
+            yield section, _read_txt_section(file_path, section)
+    else:
+        raise ValueError("Unsupported file type for knowledge base.")
+
+
+def split_pages(file_path: str, start: int, stop: int, chunk_size: int = 1000, chunk_overlap: int = 200):
+    # Runs inside the parse process pool, so it must stay a picklable module-level function.
+    # Imported here, where only the parse workers pay for them, not the web process
+    from langchain_core.documents import Document
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    # start_index lets context assembly merge overlapping neighbours at query time
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True
+    )
+    chunks = []
+    for page_number, text in iter_pages(file_path, start, stop):
+        page = Document(page_content=text, metadata={"source": file_path, "page": page_number})
+        chunks.extend(text_splitter.split_documents([page]))
+    return chunks
+
+
+class IngestionJob:
+    def __init__(self, agent_id: int, filename: str):
+        self.id = uuid.uuid4().hex
+        self.agent_id = agent_id
+        self.filename = filename
+        self.status = "queued"  # queued -> parsing -> embedding -> completed | failed
+        self.pages_total = 0
+        self.pages_parsed = 0
+        self.chunks_total = 0
+        self.chunks_embedded = 0
+        self.chunks_unchanged = 0
+        self.chunks_deleted = 0
+        self.error = None
+        self.created_at = time.time()
+        self.embedding_started_at = None
+        self.finished_at = None
+
+    def eta_seconds(self):
+        if self.status != "embedding":
+            return None
+        elapsed = time.time() - self.embedding_started_at
+        if self.pages_parsed < self.pages_total:
+            # Pages are still streaming in, so the chunk total isn't known yet
+            return round(elapsed / self.pages_parsed * (self.pages_total - self.pages_parsed), 1)
+        if not self.chunks_embedded:
+            return None
+        remaining = self.chunks_total - self.chunks_embedded
+        return round(elapsed / self.chunks_embedded * remaining, 1)
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "agent_id": self.agent_id,
+            "filename": self.filename,
+            "status": self.status,
+            "pages_total": self.pages_total,
+            "pages_parsed": self.pages_parsed,
+            "chunks_total": self.chunks_total,
+            "chunks_embedded": self.chunks_embedded,
+            "chunks_unchanged": self.chunks_unchanged,
+            "chunks_deleted": self.chunks_deleted,
+            "eta_seconds": self.eta_seconds(),
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class IngestionJobManager:
+    """Runs knowledge-base ingestion as background tasks and tracks their progress.
+
+    With a state_dir shared by several worker processes, each job's progress is
+    also written there every publish_seconds, so a status poll can be answered
+    by any worker, not only the one running the job.
+    """
+
+    def __init__(self, llm_service, max_finished_jobs: int = 1000, state_dir: str = None, publish_seconds: float = 1.0):
+        self.llm_service = llm_service
+        self.max_finished_jobs = max_finished_jobs
+        self.state_dir = state_dir
+        self.publish_seconds = publish_seconds
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        self._jobs = OrderedDict()
+        self._tasks = {}
+
+    def submit(self, agent_id: int, file_path: str, filename: str) -> IngestionJob:
+        job = IngestionJob(agent_id, filename)
+        self._jobs[job.id] = job
+        task = asyncio.create_task(self._run(job, file_path))
+        # Keep a reference so the task isn't garbage collected mid-flight
+        self._tasks[job.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.id, None))
+        self._prune()
+        return job
+
+    def get(self, job_id: str):
+        return self._jobs.get(job_id)
+
+    def get_status(self, job_id: str):
+        """The job's to_dict(), from this process or the last state another worker wrote; None if unknown."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if not self.state_dir or not job_id.isalnum():
+            return None
+        try:
+            with open(self._state_path(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _state_path(self, job_id: str) -> str:
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def _save(self, job: IngestionJob):
+        path = self._state_path(job.id)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(job.to_dict(), f)
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.warning("Couldn't save state of ingestion job %s", job.id, exc_info=True)
+
+    async def _publish(self, job: IngestionJob):
+        while True:
+            self._save(job)
+            await asyncio.sleep(self.publish_seconds)
+
+    async def _run(self, job: IngestionJob, file_path: str):
+        publisher = asyncio.create_task(self._publish(job)) if self.state_dir else None
+        try:
+            await self.llm_service.process_knowledge_base(
+                job.agent_id, file_path, job=job, document_name=job.filename
+            )
+            job.status = "completed"
+        except Exception as e:
+            # The job task inherits the upload's request id, so this log line carries it
+            logger.exception("Ingestion job %s failed", job.id)
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            if publisher:
+                publisher.cancel()
+                self._save(job)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
+            if self.state_dir:
+                try:
+                    os.remove(self._state_path(job_id))
+                except OSError:
+                    pass
@@ -0,0 +1,52 @@
+import asyncio
+import contextlib
+import os
+from collections import defaultdict
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, so only one worker process is safe
+    fcntl = None
+
+LOCK_DIR = ".locks"  # Under the store root; not a digit, so never mistaken for an agent
+_POLL_SECONDS = (0.01, 0.5)  # First and longest wait between tries for a held file lock
+
+
+class KnowledgeBaseLocks:
+    """Per-agent locks held across every worker process sharing a store root.
+
+    Tasks in one process queue on an asyncio.Lock; the holder then takes an
+    exclusive flock on the agent's lock file, which serializes it with other
+    processes. The lock files live outside the agent directories, since
+    archiving removes those. The file lock is polled rather than waited for
+    in a thread, so a cancelled waiter never ends up holding it.
+    """
+
+    def __init__(self, base_path: str):
+        self.lock_dir = os.path.join(base_path, LOCK_DIR)
+        self._local = defaultdict(asyncio.Lock)
+
+    def lock_path(self, agent_id: int) -> str:
+        return os.path.join(self.lock_dir, f"{agent_id}.lock")
+
+    @contextlib.asynccontextmanager
+    async def hold(self, agent_id: int):
+        async with self._local[agent_id]:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(self.lock_dir, exist_ok=True)
+            fd = os.open(self.lock_path(agent_id), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                delay = _POLL_SECONDS[0]
+                while True:
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        await asyncio.sleep(delay)
+                        delay = min(delay * 2, _POLL_SECONDS[1])
+                yield
+            finally:
+                # Closing the descriptor releases the flock
+                os.close(fd)
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+_VERSION_DIR = re.compile(r"^v(\d+)$")
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def plan_update(manifest: dict, document_name: str, hashes: list):
+    """Work out which chunks an upload adds and which it makes stale.
+
+    A chunk hash is only deleted once no document in the manifest references it,
+    since identical text from different documents is stored once.
+    """
+    documents = dict(manifest.get("documents", {}))
+    before = {h for doc_hashes in documents.values() for h in doc_hashes}
+    documents[document_name] = hashes
+    after = {h for doc_hashes in documents.values() for h in doc_hashes}
+    to_add = [h for h in hashes if h not in before]
+    to_delete = sorted(before - after)
+    return {"documents": documents}, to_add, to_delete
+
+
+class KnowledgeBaseVersions:
+    """On-disk layout of versioned per-agent vector stores.
+
+    Each agent directory holds immutable ``v<N>`` store directories and a
+    ``CURRENT`` pointer file. A new version is built on a copy of the current
+    one and published by atomically replacing the pointer, so readers never
+    see a half-built store.
+    """
+
+    def __init__(self, base_path: str):
+        self.base_path = base_path
+
+    def agent_dir(self, agent_id: int) -> str:
+        return os.path.join(self.base_path, str(agent_id))
+
+    def version_path(self, agent_id: int, version: int) -> str:
+        return os.path.join(self.agent_dir(agent_id), f"v{version}")
+
+    def current_version(self, agent_id: int):
+        try:
+            with open(os.path.join(self.agent_dir(agent_id), CURRENT_FILE)) as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def current_path(self, agent_id: int):
+        version = self.current_version(agent_id)
+        if version is not None:
+            return self.version_path(agent_id, version)
+        # Stores built before versioning live directly in the agent directory
+        legacy_path = self.agent_dir(agent_id)
+        if os.path.exists(os.path.join(legacy_path, "chroma.sqlite3")):
+            return legacy_path
+        return None
+
+    def next_version(self, agent_id: int) -> int:
+        """A version number never used before for this agent, including by failed builds.
+
+        Chroma keeps one client per path for the life of the process, so a
+        path that was ever opened can't be rebuilt in place.
+        """
+        versions = [self.current_version(agent_id) or 0]
+        try:
+            names = os.listdir(self.agent_dir(agent_id))
+        except OSError:
+            names = []
+        for name in names:
+            match = _VERSION_DIR.match(name)
+            if match:
+                versions.append(int(match.group(1)))
+        return max(versions) + 1
+
+    def load_manifest(self, agent_id: int, version) -> dict:
+        if version is None:
+            return {"documents": {}}
+        try:
+            with open(os.path.join(self.version_path(agent_id, version), MANIFEST_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"documents": {}}
+
+    def write_manifest(self, agent_id: int, version: int, manifest: dict):
+        path = os.path.join(self.version_path(agent_id, version), MANIFEST_FILE)
+        self._atomic_write(path, json.dumps(manifest))
+
+    def prepare(self, agent_id: int, from_version, to_version: int) -> str:
+        # Leftovers from a failed build of the same version are discarded
+        target = self.version_path(agent_id, to_version)
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        if from_version is None:
+            os.makedirs(target)
+        else:
+            shutil.copytree(self.version_path(agent_id, from_version), target)
+        return target
+
+    def publish(self, agent_id: int, version: int):
+        self._atomic_write(os.path.join(self.agent_dir(agent_id), CURRENT_FILE), str(version))
+
+    def superseded_at(self, agent_id: int, version: int):
+        """When the version after this one was published, or None if none was.
+
+        A version's manifest is written just before its pointer is published,
+        so the next version's manifest time stands in for the publish time.
+        """
+        current = self.current_version(agent_id)
+        if current is None or version >= current:
+            return None
+        later = []
+        for name in os.listdir(self.agent_dir(agent_id)):
+            match = _VERSION_DIR.match(name)
+            if match and version < int(match.group(1)) <= current:
+                later.append(int(match.group(1)))
+        try:
+            return os.path.getmtime(os.path.join(self.version_path(agent_id, min(later)), MANIFEST_FILE))
+        except (OSError, ValueError):
+            return None
+
+    def prune(self, agent_id: int, keep: int = 2, grace_seconds: float = 0):
+        # Keep the previous version too: in-flight requests may still be reading it.
+        # Other worker processes switch to a new version on their next request, so
+        # older ones are only removed grace_seconds after they stopped being current.
+        current = self.current_version(agent_id)
+        if current is None:
+            return
+        agent_dir = self.agent_dir(agent_id)
+        now = time.time()
+        for name in os.listdir(agent_dir):
+            match = _VERSION_DIR.match(name)
+            path = os.path.join(agent_dir, name)
+            if match:
+                version = int(match.group(1))
+                if current - keep < version <= current:
+                    continue
+                if version < current and grace_seconds > 0:
+                    superseded_at = self.superseded_at(agent_id, version)
+                    if superseded_at is None or now - superseded_at < grace_seconds:
+                        continue
+            elif name == CURRENT_FILE or name.startswith("."):
+                continue
+            # Superseded versions and files of a pre-versioning store
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+
+    def _atomic_write(self, path: str, content: str):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
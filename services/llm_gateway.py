@@ -0,0 +1,140 @@
+import asyncio
+import contextlib
+import random
+import time
+
+
+class GatewayOverloaded(Exception):
+    pass
+
+
+class TokenBucket:
+    """Allows `rate` calls per second on average, in bursts of up to `burst`.
+
+    Only used from the event loop thread, so it needs no lock.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class LLMGateway:
+    """Admission control in front of the LLM provider.
+
+    A call waits for a per-agent slot, then a global slot, then a rate-limit
+    token. At most max_concurrency + max_queue calls are admitted at once;
+    beyond that callers get GatewayOverloaded immediately instead of queueing.
+    Concurrent calls with the same key share one provider request, and errors
+    in retry_on are retried with jittered exponential backoff.
+    """
+
+    def __init__(self, max_concurrency: int = 16, per_agent_concurrency: int = 4, max_queue: int = 64,
+                 rate_per_second: float = 0.0, burst: int = None, max_retries: int = 3,
+                 backoff_base: float = 0.5, backoff_max: float = 8.0, retry_on: tuple = ()):
+        self.max_concurrency = max_concurrency
+        self.per_agent_concurrency = per_agent_concurrency
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_on = retry_on
+        # A rate of 0 means the provider's own limits are the only ones
+        self._bucket = TokenBucket(rate_per_second, burst or max_concurrency) if rate_per_second > 0 else None
+        self._global = asyncio.Semaphore(max_concurrency)
+        self._per_agent = {}  # agent_id -> [semaphore, admitted calls]; dropped when idle
+        self._shared = {}  # key -> task of the call in flight
+        self._admitted = 0  # Only touched from the event loop thread
+        self._active = 0
+        self.rejected = 0
+        self.coalesced = 0
+        self.retries = 0
+
+    @contextlib.asynccontextmanager
+    async def slot(self, agent_id: int):
+        """Holds a per-agent and a global slot; raises GatewayOverloaded when the queue is full."""
+        if self._admitted >= self.max_concurrency + self.max_queue:
+            self.rejected += 1
+            raise GatewayOverloaded("The language model is at capacity, retry shortly.")
+        self._admitted += 1
+        agent = self._per_agent.setdefault(agent_id, [asyncio.Semaphore(self.per_agent_concurrency), 0])
+        agent[1] += 1
+        try:
+            async with agent[0], self._global:
+                self._active += 1
+                try:
+                    yield
+                finally:
+                    self._active -= 1
+        finally:
+            self._admitted -= 1
+            agent[1] -= 1
+            if not agent[1]:
+                del self._per_agent[agent_id]
+
+    async def throttle(self):
+        """Waits for a rate-limit token; call once per provider request."""
+        if self._bucket:
+            await self._bucket.acquire()
+
+    async def _call(self, agent_id: int, fn):
+        async with self.slot(agent_id):
+            for attempt in range(self.max_retries + 1):
+                await self.throttle()
+                try:
+                    return await fn()
+                except self.retry_on:
+                    if attempt == self.max_retries:
+                        raise
+                    self.retries += 1
+                    # Full jitter, so throttled callers don't all come back at once
+                    await asyncio.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
+
+    async def call(self, agent_id: int, fn, key=None):
+        """Runs the coroutine returned by fn() through the gateway and returns its result.
+
+        Calls made with the same key while one is in flight wait for that one's
+        result instead of making their own request.
+        """
+        if key is None:
+            return await self._call(agent_id, fn)
+        task = self._shared.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            # Its own task, so one caller going away doesn't cancel it for the others
+            task = asyncio.ensure_future(self._call(agent_id, fn))
+            self._shared[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._shared.get(key) is task:
+            del self._shared[key]
+        if not task.cancelled():
+            task.exception()  # Retrieved here so an error nobody awaited isn't logged as lost
+
+    def stats(self) -> dict:
+        return {
+            "active": self._active,
+            "queued": self._admitted - self._active,
+            "max_concurrency": self.max_concurrency,
+            "per_agent_concurrency": self.per_agent_concurrency,
+            "max_queue": self.max_queue,
+            "rate_per_second": self._bucket.rate if self._bucket else None,
+            "rejected": self.rejected,
+            "coalesced": self.coalesced,
+            "retries": self.retries,
+        }
@@ -1,119 +1,591 @@
-import google.generativeai as genai
 import os
-import gc
 import time
-import shutil
+import asyncio
+import contextlib
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dotenv import load_dotenv
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
-from langchain.prompts import ChatPromptTemplate
-from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
+
+from services.context_assembly import assemble_context
+from services.ingestion import count_pages, split_pages
+from services.kb_locks import KnowledgeBaseLocks
+from services.kb_versions import KnowledgeBaseVersions, chunk_hash, plan_update
+from services.llm_gateway import LLMGateway
+from services.metrics import REGISTRY, SIZE_BUCKETS
+from services.prompt_cache import PromptCache, build_prompt, build_system_prompt
+from services.response_cache import ResponseCache, response_cache_key
+from services.retrieval import RETRIEVAL_DEFAULTS, estimate_tokens, hybrid_retrieve, hybrid_retrieve_many
+from services.sparse_index import BM25Index
+from services.storage_tiers import TieredStorage
+from services.tracing import stage
+from services.vector_store_cache import VectorStoreCache, estimate_store_bytes
 
 load_dotenv()
 
+RAG_STAGE_SECONDS = REGISTRY.histogram("rag_stage_seconds", "Time spent in each stage of answering a chat query.", labels=("stage",))
+RAG_RETRIEVED_CHUNKS = REGISTRY.histogram("rag_retrieved_chunks", "Chunks retrieved per query.", buckets=SIZE_BUCKETS)
+RAG_CONTEXT_TOKENS = REGISTRY.histogram("rag_context_tokens", "Estimated tokens of context sent per query.", buckets=SIZE_BUCKETS)
+RAG_LLM_TOKENS = REGISTRY.counter("rag_llm_tokens_total", "LLM tokens per provider request (shared calls count once), from the provider when it reports them.", labels=("direction",))
+RAG_ANSWERS = REGISTRY.counter("rag_answers_total", "Chat answers by where they came from.", labels=("source",))
+KB_STAGE_SECONDS = REGISTRY.histogram("kb_ingest_stage_seconds", "Time spent in each stage of knowledge-base ingestion.", labels=("stage",))
+KB_PAGES = REGISTRY.counter("kb_ingest_pages_total", "Pages parsed by knowledge-base ingestion.")
+KB_CHUNKS = REGISTRY.counter("kb_ingest_chunks_total", "Chunks seen by knowledge-base ingestion, by outcome.", labels=("result",))
+
+def _close_store(vector_store):
+    # Chroma's clients are shared per path and refcounted; this drops one reference
+    vector_store._client.close()
+
+def _new_chroma(persist_directory: str, embedding_function):
+    # Chroma and its dependencies take seconds to import; paid by the first store opened
+    from langchain_chroma import Chroma
+    return Chroma(persist_directory=persist_directory, embedding_function=embedding_function)
+
 class LLMAgentService:
-    def __init__(self, api_key: str):
-        # Make sure api_key is not None or empty
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY is not set in environment variables.")
-        self.embeddings_model = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004", google_api_key=api_key)
-        self.llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.2, google_api_key=api_key)
-        self.base_vector_store_path = os.path.join("/tmp", "chroma_db") # Base dir for all agent DBs
+    def __init__(self, api_key: str, embedding_backend: str = "google", llm_backend: str = "google"):
+        # Only the google backends need api_key; "fake" and "local" run offline.
+        # The model clients and their SDKs are loaded on first use (or by warm_up),
+        # so importing the service stays fast.
+        self.api_key = api_key
+        self.embedding_backend = embedding_backend
+        self.llm_backend = llm_backend
+        self._embeddings_model = None
+        self._embedding_cache = None
+        self._llm = None
+        self._clients_lock = threading.Lock()
+        self.llm_gateway = LLMGateway(
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "16")),
+            per_agent_concurrency=int(os.getenv("LLM_PER_AGENT_CONCURRENCY", "4")),
+            max_queue=int(os.getenv("LLM_MAX_QUEUE", "64")),
+            rate_per_second=float(os.getenv("LLM_RATE_PER_SECOND", "0")),
+            burst=int(os.getenv("LLM_RATE_BURST", "0")) or None,
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+            backoff_base=float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.5")),
+            backoff_max=float(os.getenv("LLM_RETRY_MAX_SECONDS", "8")),
+        )
+        self.base_vector_store_path = os.getenv("VECTOR_STORE_DIR", os.path.join("/tmp", "chroma_db")) # Base dir for all agent DBs
         os.makedirs(self.base_vector_store_path, exist_ok=True) # Ensure it exists
+        self.vector_store_cache = VectorStoreCache(
+            max_entries=int(os.getenv("VECTOR_STORE_CACHE_MAX_ENTRIES", "32")),
+            max_bytes=int(os.getenv("VECTOR_STORE_CACHE_MAX_MB", "512")) * 1024 * 1024,
+            close=lambda store: _close_store(store[0]),
+        )
+        parse_workers = int(os.getenv("KB_PARSE_WORKERS", "2"))
+        self.parse_workers = parse_workers
+        self._parse_pool = self._new_parse_pool()
+        self.embed_batch_size = int(os.getenv("KB_EMBED_BATCH_SIZE", "64"))
+        self.parse_window_pages = int(os.getenv("KB_PARSE_WINDOW_PAGES", "8"))
+        # Windows parsed ahead of embedding: enough to keep every worker busy, and no more
+        self.parse_read_ahead = parse_workers + 1
+        self.kb_versions = KnowledgeBaseVersions(self.base_vector_store_path)
+        # Idle stores are packed into archives on persistent storage and unpacked on next use
+        self.storage = TieredStorage(
+            self.kb_versions,
+            # Archiving is off unless a persistent directory is set explicitly
+            os.getenv("VECTOR_STORE_ARCHIVE_DIR") or None,
+            idle_seconds=float(os.getenv("KB_ARCHIVE_IDLE_SECONDS", "86400")),
+        )
+        # Rebuilds, archiving and rehydration of an agent's store are serialized
+        # across every worker process that shares base_vector_store_path
+        self.kb_locks = KnowledgeBaseLocks(self.base_vector_store_path)
+        # Superseded versions outlive their successor's publish by this long, so
+        # other workers finish the queries they started on them
+        self.prune_grace_seconds = float(os.getenv("KB_PRUNE_GRACE_SECONDS", "300"))
+        self.context_stats = {"requests": 0, "retrieved_tokens": 0, "context_tokens": 0}
+        self.prompt_cache = PromptCache(max_entries=int(os.getenv("PROMPT_CACHE_MAX_ENTRIES", "1024")))
+        self.response_cache = ResponseCache(
+            similarity_threshold=float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95")),
+            ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600")),
+            max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000")),
+        )
+
+    @property
+    def embeddings_model(self):
+        if self._embeddings_model is None:
+            with self._clients_lock:
+                if self._embeddings_model is None:
+                    from services.backends import create_embeddings
+                    from services.embedding_cache import CachedEmbeddings, EmbeddingCache
+                    embeddings, embedding_model_name = create_embeddings(self.embedding_backend, self.api_key)
+                    self._embedding_cache = EmbeddingCache(
+                        os.getenv("EMBEDDING_CACHE_PATH", os.path.join("/tmp", "embedding_cache.sqlite3")),
+                        max_bytes=int(os.getenv("EMBEDDING_CACHE_MAX_MB", "1024")) * 1024 * 1024,
+                    )
+                    # Identical text (re-uploads, shared boilerplate, repeated questions) is embedded once
+                    self._embeddings_model = CachedEmbeddings(embeddings, self._embedding_cache, embedding_model_name)
+        return self._embeddings_model
+
+    @property
+    def embedding_cache(self):
+        # None until the embeddings model is first used
+        return self._embedding_cache
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            with self._clients_lock:
+                if self._llm is None:
+                    from services.backends import create_llm, retryable_errors
+                    # The gateway retries the provider's throttling and transient errors
+                    self.llm_gateway.retry_on = retryable_errors(self.llm_backend)
+                    self._llm = create_llm(self.llm_backend, self.api_key)
+        return self._llm
+
+    @property
+    def models_loaded(self) -> bool:
+        return self._embeddings_model is not None and self._llm is not None
+
+    def _load_models(self):
+        self.embeddings_model
+        self.llm
+
+    async def ensure_models(self):
+        # The properties block while the SDKs import and the clients are built (or
+        # while warm_up is doing that), so async callers load them in a thread first
+        if not self.models_loaded:
+            await asyncio.to_thread(self._load_models)
+
+    def warm_up(self):
+        """Builds the model clients and imports the vector store; blocks, so run it in a thread."""
+        self._load_models()
+        build_prompt({})  # Loads LangChain's prompt modules
+        import langchain_chroma  # noqa: F401
+
+    def shutdown(self):
+        self._parse_pool.shutdown(wait=False, cancel_futures=True)
+
+    def parse_pool_healthy(self) -> bool:
+        # A worker that died (OOM kill, crash) breaks the whole pool until _parse replaces it
+        return not getattr(self._parse_pool, "_broken", False)
+
+    def _new_parse_pool(self):
+        # Spawned (not forked) workers so they don't inherit the gRPC/Chroma threads
+        return ProcessPoolExecutor(
+            max_workers=self.parse_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    async def _parse(self, fn, *args):
+        pool = self._parse_pool
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+        except BrokenProcessPool:
+            # The upload that hit it fails, but later ones get a fresh pool
+            if self._parse_pool is pool:
+                self._parse_pool = self._new_parse_pool()
+                pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    async def _get_agent_chroma_path(self, agent_id: int):
+        # CURRENT is read on every request, so a version published by another
+        # worker is picked up here and the cached store for the old path is replaced
+        if self.storage.is_archived(agent_id):
+            async with self.kb_locks.hold(agent_id):
+                await asyncio.to_thread(self.storage.rehydrate, agent_id)
+        self.storage.touch(agent_id)
+        return self.kb_versions.current_path(agent_id)
+
+    async def archive_idle_stores(self) -> int:
+        """Archives the stores that have been idle for storage.idle_seconds; returns how many."""
+        archived = 0
+        for agent_id in await asyncio.to_thread(self.storage.idle_agents):
+            async with self.kb_locks.hold(agent_id):
+                # Checked again under the lock: a chat or upload may have come in since
+                if not self.storage.is_idle(agent_id):
+                    continue
+                # Releases Chroma's shared client for the path before the files go
+                self.vector_store_cache.invalidate(agent_id)
+                await asyncio.to_thread(self.storage.archive, agent_id)
+                archived += 1
+        return archived
+
+    def _build_sparse_index(self, vector_store):
+        # Stores built before hybrid retrieval: index what is already in Chroma
+        sparse_index = BM25Index()
+        offset = 0
+        while True:
+            page = vector_store.get(limit=1000, offset=offset, include=["documents"])
+            if not page["ids"]:
+                break
+            for chunk_id, text in zip(page["ids"], page["documents"]):
+                sparse_index.add(chunk_id, text)
+            offset += len(page["ids"])
+        return sparse_index
+
+    def _open_agent_store(self, agent_chroma_path: str):
+        # Blocks on disk reads, so run it in a thread. A published version is never
+        # written to: one without bm25.json is indexed in memory, and the next
+        # upload saves an index with the version it builds.
+        vector_store = _new_chroma(agent_chroma_path, self.embeddings_model)
+        sparse_index = BM25Index.load(agent_chroma_path) or self._build_sparse_index(vector_store)
+        return (vector_store, sparse_index), estimate_store_bytes(agent_chroma_path)
+
+    @contextlib.asynccontextmanager
+    async def _agent_store(self, agent_id: int, agent_chroma_path: str):
+        # Yields the (vector_store, sparse_index) pair for the agent's current KB version,
+        # checked out of the cache so it isn't closed while in use
+        with stage(RAG_STAGE_SECONDS, "open_store"):
+            store = self.vector_store_cache.checkout(agent_id, agent_chroma_path)
+            if store is None:
+                store, size_bytes = await asyncio.to_thread(self._open_agent_store, agent_chroma_path)
+                store = self.vector_store_cache.put(
+                    agent_id, agent_chroma_path, store, size_bytes=size_bytes, checkout=True
+                )
+        try:
+            yield store
+        finally:
+            self.vector_store_cache.checkin(store)
+
+    async def _begin_version(self, agent_id: int, current_version):
+        # Build the next version on a copy; chats keep reading the current one meanwhile.
+        # Numbers left behind by failed builds are skipped, not reused.
+        new_version = self.kb_versions.next_version(agent_id)
+        new_path = await asyncio.to_thread(self.kb_versions.prepare, agent_id, current_version, new_version)
+        vector_store = await asyncio.to_thread(_new_chroma, new_path, self.embeddings_model)
+        # The sparse index lives next to the Chroma files and is versioned with them;
+        # None for stores built before it, which get one built once the store is complete.
+        sparse_index = await asyncio.to_thread(BM25Index.load, new_path)
+        return new_version, new_path, vector_store, sparse_index
+
+    async def _embed_chunks(self, vector_store, sparse_index, batch: list, job=None):
+        chunk_ids = [h for h, _ in batch]
+        await vector_store.aadd_documents([chunk for _, chunk in batch], ids=chunk_ids)
+        if sparse_index is not None:
+            for h, chunk in batch:
+                sparse_index.add(h, chunk.page_content)
+        if job:
+            job.chunks_embedded += len(batch)
+
+    async def process_knowledge_base(self, agent_id: int, file_path: str, job=None, document_name: str = None):
+        document_name = document_name or os.path.basename(file_path)
+        await self.ensure_models()
+        # Parsing and splitting are CPU bound, keep them off the event loop
+        if job:
+            job.status = "parsing"
+        with stage(KB_STAGE_SECONDS, "count_pages"):
+            page_count = await self._parse(count_pages, file_path)
+        if job:
+            job.pages_total = page_count
+
+        # Pages are parsed in windows, a few ahead of the one being embedded, so
+        # embedding starts early and memory doesn't grow with the file
+        windows = iter(range(0, page_count, self.parse_window_pages))
+        parsing = deque()
 
-    def _get_agent_chroma_path(self, agent_id: int):
-        return os.path.join(self.base_vector_store_path, str(agent_id))
-
-    def _escape_braces(self, text):
-        if not isinstance(text, str):
-            return text
-        return text.replace("{", "{{").replace("}", "}}")
-
-    async def process_knowledge_base(self, agent_id: int, file_path: str):
-        # Load documents
-        if file_path.endswith(".pdf"):
-            loader = PyPDFLoader(file_path)
-        elif file_path.endswith(".txt"):
-            loader = TextLoader(file_path)
-        # Add more loaders for .csv, .docx etc. using appropriate LangChain loaders
-        else:
-            raise ValueError("Unsupported file type for knowledge base.")
-        documents = loader.load()
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        chunks = text_splitter.split_documents(documents)
-        if not chunks:
-           raise ValueError("No content found in the uploaded file.")
-        
-        # Delete existing vector store for this agent before creating a new one
-        agent_chroma_path = self._get_agent_chroma_path(agent_id)
-        if os.path.exists(agent_chroma_path):
+        def parse_next_window():
+            start = next(windows, None)
+            if start is not None:
+                stop = min(start + self.parse_window_pages, page_count)
+                parsing.append((stop - start, asyncio.ensure_future(self._parse(split_pages, file_path, start, stop))))
+
+        async with self.kb_locks.hold(agent_id):
+            # Updates to an archived store start from its archived content
+            await asyncio.to_thread(self.storage.rehydrate, agent_id)
+            self.storage.touch(agent_id)
+            current_version = self.kb_versions.current_version(agent_id)
+            manifest = self.kb_versions.load_manifest(agent_id, current_version)
+            stored = {h for hashes in manifest.get("documents", {}).values() for h in hashes}
+            # Content-hash the chunks; identical text is stored once per agent
+            document_hashes = {}  # Ordered set of this document's chunk hashes
+            batch = []
+            new_path = vector_store = sparse_index = None
             try:
-                # Try to load and delete any existing Chroma instance
-                tmp_vs = Chroma(
-                    persist_directory=agent_chroma_path,
-                    embedding_function=self.embeddings_model
+                for _ in range(self.parse_read_ahead):
+                    parse_next_window()
+                while parsing:
+                    window_pages, window = parsing.popleft()
+                    # Time spent waiting on parse workers, not their total parse time
+                    with stage(KB_STAGE_SECONDS, "parse_wait"):
+                        chunks = await window
+                    parse_next_window()
+                    KB_PAGES.inc(window_pages)
+                    new_chunks = 0
+                    for chunk in chunks:
+                        chunk.metadata["source"] = document_name
+                        h = chunk_hash(chunk.page_content)
+                        if h in document_hashes:
+                            continue
+                        document_hashes[h] = None
+                        if h not in stored:
+                            batch.append((h, chunk))
+                            new_chunks += 1
+                    if job:
+                        job.pages_parsed += window_pages
+                        job.chunks_total += new_chunks
+                        job.chunks_unchanged = len(document_hashes) - job.chunks_total
+                        if job.status == "parsing":
+                            job.status = "embedding"
+                            job.embedding_started_at = time.time()
+                    # Embed in bounded batches so memory and request size stay flat for large files
+                    while len(batch) >= self.embed_batch_size or (batch and not parsing):
+                        if vector_store is None:
+                            new_version, new_path, vector_store, sparse_index = await self._begin_version(agent_id, current_version)
+                        with stage(KB_STAGE_SECONDS, "embed"):
+                            await self._embed_chunks(vector_store, sparse_index, batch[:self.embed_batch_size], job)
+                        del batch[:self.embed_batch_size]
+
+                if not document_hashes:
+                    raise ValueError("No content found in the uploaded file.")
+                # Everything new was embedded above; what's left is dropping stale chunks
+                manifest, _, to_delete = plan_update(manifest, document_name, list(document_hashes))
+                if job:
+                    job.chunks_deleted = len(to_delete)
+                embedded = sum(1 for h in document_hashes if h not in stored)
+                KB_CHUNKS.labels("embedded").inc(embedded)
+                KB_CHUNKS.labels("unchanged").inc(len(document_hashes) - embedded)
+                KB_CHUNKS.labels("deleted").inc(len(to_delete))
+
+                if vector_store is None:
+                    if not to_delete:
+                        # Same content (or only already-stored chunks): just record the document
+                        self.kb_versions.write_manifest(agent_id, current_version, manifest)
+                        return self.kb_versions.version_path(agent_id, current_version)
+                    new_version, new_path, vector_store, sparse_index = await self._begin_version(agent_id, current_version)
+                with stage(KB_STAGE_SECONDS, "finalize"):
+                    if to_delete:
+                        await asyncio.to_thread(vector_store.delete, ids=to_delete)
+                    if sparse_index is None:
+                        sparse_index = await asyncio.to_thread(self._build_sparse_index, vector_store)
+                    else:
+                        sparse_index.remove_many(to_delete)
+                    await asyncio.to_thread(sparse_index.save, new_path)
+                    self.kb_versions.write_manifest(agent_id, new_version, manifest)
+                    self.kb_versions.publish(agent_id, new_version)
+            except BaseException:
+                # A half-built version is never reused, so nothing will close its client later
+                if vector_store is not None:
+                    _close_store(vector_store)
+                raise
+            finally:
+                for _, window in parsing:
+                    window.cancel()
+            # Reuse the freshly built store for the next chat instead of reopening it
+            size_bytes = await asyncio.to_thread(estimate_store_bytes, new_path)
+            self.vector_store_cache.put(agent_id, new_path, (vector_store, sparse_index), size_bytes=size_bytes)
+            self.response_cache.invalidate(agent_id)
+            await asyncio.to_thread(self.kb_versions.prune, agent_id, grace_seconds=self.prune_grace_seconds)
+        return new_path
+
+    async def _prepare_turn(self, agent_id: int, agent_config: dict, user_query: str, usage: dict):
+        # Returns (answer, None, None, None) when no LLM call is needed,
+        # otherwise (None, chain, prompt_vars, cache_entry) for the caller to run.
+        # Context and token counts for the request are written into usage.
+        with stage(RAG_STAGE_SECONDS, "resolve_kb"):
+            agent_chroma_path = await self._get_agent_chroma_path(agent_id)
+
+        if not agent_chroma_path:
+            RAG_ANSWERS.labels("fallback").inc()
+            return agent_config.get("fallback_message", "I'm sorry, I don't have a knowledge base configured yet for this agent."), None, None, None
+
+        await self.ensure_models()
+        settings = self._retrieval_settings(agent_config)
+        query_vector = None
+        if agent_config.get("cache_responses") or settings["dense_weight"] > 0:
+            # Embedded once here for both the response cache and dense retrieval
+            with stage(RAG_STAGE_SECONDS, "embed_query"):
+                query_vector = await self.embeddings_model.aembed_query(user_query)
+
+        cache_key = None
+        if agent_config.get("cache_responses"):
+            # The store path names the KB version, so a re-upload changes the key.
+            cache_key = response_cache_key(agent_config, agent_chroma_path)
+            with stage(RAG_STAGE_SECONDS, "response_cache"):
+                cached = self.response_cache.lookup(agent_id, cache_key, query_vector)
+            if cached is not None:
+                usage["cached"] = True
+                RAG_ANSWERS.labels("cache").inc()
+                return cached, None, None, None
+
+        # Retrieve relevant documents for context: dense and BM25 results fused by rank
+        async with self._agent_store(agent_id, agent_chroma_path) as (vector_store, sparse_index):
+            with stage(RAG_STAGE_SECONDS, "retrieve"):
+                docs = await hybrid_retrieve(
+                    vector_store,
+                    sparse_index,
+                    user_query,
+                    k=settings["retrieval_k"],
+                    dense_weight=settings["dense_weight"],
+                    sparse_weight=settings["sparse_weight"],
+                    query_vector=query_vector,
                 )
-                del tmp_vs
-            except Exception:
-                pass
-            gc.collect()
-            time.sleep(1)  # Give the OS a moment to release handles
-            shutil.rmtree(agent_chroma_path) # Clean up old data
-
-        vector_store = await Chroma.afrom_documents(
-            chunks,
-            self.embeddings_model,
-            persist_directory=agent_chroma_path
-        )
-        vector_store = None
-        gc.collect()
-        return agent_chroma_path
+        chain, prompt_vars = self._compose_turn(agent_id, agent_config, settings, user_query, docs, usage)
+        cache_entry = (cache_key, query_vector) if cache_key else None
+        return None, chain, prompt_vars, cache_entry
 
-    async def get_agent_response(self, agent_id: int, agent_config: dict, user_query: str):
-        agent_chroma_path = self._get_agent_chroma_path(agent_id)
+    def _retrieval_settings(self, agent_config: dict) -> dict:
+        return {key: agent_config.get(key, default) for key, default in RETRIEVAL_DEFAULTS.items()}
 
-        if not os.path.exists(agent_chroma_path) or not os.listdir(agent_chroma_path):
-            return agent_config.get("fallback_message", "I'm sorry, I don't have a knowledge base configured yet for this agent.")
+    def _compose_turn(self, agent_id: int, agent_config: dict, settings: dict, user_query: str, docs: list, usage: dict):
+        # Merge overlapping neighbours, drop near-duplicates and cap at the token budget
+        with stage(RAG_STAGE_SECONDS, "assemble_context"):
+            context, context_stats = assemble_context(docs, settings["max_context_tokens"])
+        usage.update(context_stats)
+        self._record_context_stats(context_stats)
 
-        vector_store = Chroma(
-            persist_directory=agent_chroma_path,
-            embedding_function=self.embeddings_model
-        )
-        retriever = vector_store.as_retriever()
-
-        # Retrieve relevant documents for context
-        docs = await retriever.aget_relevant_documents(user_query)
-        context = "\n".join([doc.page_content for doc in docs]) if docs else ""
-
-        system_prompt_template = (
-            "You are a helpful AI assistant for the brand \"{brand_name}\".\n"
-            "Your purpose is: {purpose}.\n"
-            "Maintain a {tone} tone in all your responses.\n"
-            "Answer questions based ONLY on the provided context. If you cannot find the answer in the context,\n"
-            "politely state that you don't have enough information and provide the fallback message: \"{fallback_message}\".\n\n"
-            "Context:\n"
-            "{context}"
-        )
+        # The system prompt and chain are compiled once per agent config version
+        with stage(RAG_STAGE_SECONDS, "build_prompt"):
+            chain = self.prompt_cache.get_chain(agent_id, agent_config, self.llm)
+        prompt_vars = {"context": context, "input": user_query}
+        # Estimate; replaced by the provider's count when the response reports one
+        usage["input_tokens"] = estimate_tokens(build_system_prompt(agent_config)) + context_stats["context_tokens"] + estimate_tokens(user_query)
+        return chain, prompt_vars
+
+    def _record_context_stats(self, context_stats: dict):
+        self.context_stats["requests"] += 1
+        self.context_stats["retrieved_tokens"] += context_stats["retrieved_tokens"]
+        self.context_stats["context_tokens"] += context_stats["context_tokens"]
+        RAG_RETRIEVED_CHUNKS.observe(context_stats["retrieved_chunks"])
+        RAG_CONTEXT_TOKENS.observe(context_stats["context_tokens"])
+
+    def _record_provider_usage(self, usage: dict, message):
+        # Fills in the answer's usage; provider tokens are counted by _count_llm_tokens
+        usage_metadata = getattr(message, "usage_metadata", None)
+        if usage_metadata:
+            usage["input_tokens"] = usage_metadata.get("input_tokens", usage["input_tokens"])
+            usage["output_tokens"] = usage_metadata.get("output_tokens")
+        RAG_ANSWERS.labels("llm").inc()
+
+    def _count_llm_tokens(self, usage: dict, message):
+        # Once per provider request, so rag_llm_tokens_total tracks spend
+        usage_metadata = getattr(message, "usage_metadata", None) or {}
+        RAG_LLM_TOKENS.labels("input").inc(usage_metadata.get("input_tokens", usage["input_tokens"]))
+        if usage_metadata.get("output_tokens"):
+            RAG_LLM_TOKENS.labels("output").inc(usage_metadata["output_tokens"])
+
+    def _remember(self, agent_id: int, cache_entry, answer: str):
+        if cache_entry:
+            cache_key, query_vector = cache_entry
+            self.response_cache.store(agent_id, cache_key, query_vector, answer)
+
+    async def get_agent_response(self, agent_id: int, agent_config: dict, user_query: str, usage: dict = None):
+        usage = {} if usage is None else usage
+        answer, chain, prompt_vars, cache_entry = await self._prepare_turn(agent_id, agent_config, user_query, usage)
+        if answer is not None:
+            return answer
+        return await self._generate(agent_id, chain, prompt_vars, cache_entry, usage)
+
+    async def _generate(self, agent_id: int, chain, prompt_vars: dict, cache_entry, usage: dict) -> str:
+        # Identical prompts in flight at the same time (a burst of the same question) share one call
+        key = (agent_id, id(chain), prompt_vars["context"], prompt_vars["input"])
+
+        async def invoke():
+            response = await chain.ainvoke(prompt_vars)
+            # Only the caller that started the shared call gets here
+            self._count_llm_tokens(usage, response)
+            return response
+
+        with stage(RAG_STAGE_SECONDS, "generate"):
+            response = await self.llm_gateway.call(agent_id, invoke, key=key)
+        self._record_provider_usage(usage, response)
+        answer = response.content if hasattr(response, "content") else str(response)
+        self._remember(agent_id, cache_entry, answer)
+        return answer
+
+    async def stream_agent_response(self, agent_id: int, agent_config: dict, user_query: str, usage: dict = None):
+        usage = {} if usage is None else usage
+        answer, chain, prompt_vars, cache_entry = await self._prepare_turn(agent_id, agent_config, user_query, usage)
+        if answer is not None:
+            yield answer
+            return
+
+        parts = []
+        message = None
+        # Streams hold a gateway slot but are not retried or shared: tokens may already be sent
+        start = time.perf_counter()
+        async with self.llm_gateway.slot(agent_id):
+            await self.llm_gateway.throttle()
+            async for chunk in chain.astream(prompt_vars):
+                if message is None:
+                    RAG_STAGE_SECONDS.labels("first_token").observe(time.perf_counter() - start)
+                # Adding message chunks also merges their usage metadata
+                message = chunk if message is None else message + chunk
+                text = chunk.content if hasattr(chunk, "content") else str(chunk)
+                if text:
+                    parts.append(text)
+                    yield text
+        RAG_STAGE_SECONDS.labels("generate").observe(time.perf_counter() - start)
+        self._count_llm_tokens(usage, message)
+        self._record_provider_usage(usage, message)
+        self._remember(agent_id, cache_entry, "".join(parts))
+
+    async def batch_agent_responses(self, agent_id: int, agent_config: dict, queries: list, concurrency: int = 8):
+        """Answers many queries against one open store, yielding results as they complete.
+
+        All queries are embedded in one batched call and retrieved together; only
+        the LLM calls run per query, at most `concurrency` at a time. Each result
+        is {"index", "query", "response", "usage"}, or {"index", "query", "error"}
+        when that query's generation failed.
+        """
+        with stage(RAG_STAGE_SECONDS, "resolve_kb"):
+            agent_chroma_path = await self._get_agent_chroma_path(agent_id)
+        if not agent_chroma_path:
+            fallback = agent_config.get("fallback_message", "I'm sorry, I don't have a knowledge base configured yet for this agent.")
+            RAG_ANSWERS.labels("fallback").inc(len(queries))
+            for index, query in enumerate(queries):
+                yield {"index": index, "query": query, "response": fallback, "usage": {}}
+            return
+
+        await self.ensure_models()
+        # Batch stages are timed once for the whole batch
+        with stage(RAG_STAGE_SECONDS, "embed_query_batch"):
+            query_vectors = await self.embeddings_model.aembed_queries(queries)
+        pending = list(range(len(queries)))
+        cache_key = None
+        if agent_config.get("cache_responses"):
+            cache_key = response_cache_key(agent_config, agent_chroma_path)
+            misses = []
+            for index in pending:
+                cached = self.response_cache.lookup(agent_id, cache_key, query_vectors[index])
+                if cached is None:
+                    misses.append(index)
+                else:
+                    RAG_ANSWERS.labels("cache").inc()
+                    yield {"index": index, "query": queries[index], "response": cached, "usage": {"cached": True}}
+            pending = misses
+        if not pending:
+            return
+
+        settings = self._retrieval_settings(agent_config)
+        async with self._agent_store(agent_id, agent_chroma_path) as (vector_store, sparse_index):
+            with stage(RAG_STAGE_SECONDS, "retrieve_batch"):
+                docs_per_query = await hybrid_retrieve_many(
+                    vector_store,
+                    sparse_index,
+                    [queries[index] for index in pending],
+                    [query_vectors[index] for index in pending],
+                    k=settings["retrieval_k"],
+                    dense_weight=settings["dense_weight"],
+                    sparse_weight=settings["sparse_weight"],
+                )
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def answer(index: int, docs: list):
+            query, usage = queries[index], {}
+            chain, prompt_vars = self._compose_turn(agent_id, agent_config, settings, query, docs, usage)
+            cache_entry = (cache_key, query_vectors[index]) if cache_key else None
+            async with semaphore:
+                try:
+                    response = await self._generate(agent_id, chain, prompt_vars, cache_entry, usage)
+                except Exception as e:
+                    return {"index": index, "query": query, "error": str(e)}
+            return {"index": index, "query": query, "response": response, "usage": usage}
+
+        tasks = [asyncio.create_task(answer(index, docs)) for index, docs in zip(pending, docs_per_query)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # The client went away or a task failed unexpectedly: don't leave LLM calls running
+            for task in tasks:
+                task.cancel()
 
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", system_prompt_template),
-            ("human", "{input}"),
-        ])
-
-        # Prepare all variables for the prompt
-        prompt_vars = {
-            "brand_name": self._escape_braces(agent_config.get("name", "your brand")),
-            "purpose": self._escape_braces(agent_config.get("purpose", "answer questions")),
-            "tone": self._escape_braces(agent_config.get("tone", "neutral")),
-            "fallback_message": self._escape_braces(agent_config.get("fallback_message", "I'm sorry, I cannot answer that based on my current knowledge.")),
-            "context": context,
-            "input": user_query
-        }
-
-        # Generate response
-        chain = prompt | self.llm
-        response = await chain.ainvoke(prompt_vars)
-        return response.content if hasattr(response, "content") else str(response)
-
-llm_service = LLMAgentService(os.getenv("GEMINI_API_KEY"))
+# MODEL_BACKEND sets both; EMBEDDING_BACKEND and LLM_BACKEND override it per model
+_model_backend = os.getenv("MODEL_BACKEND", "google")
+llm_service = LLMAgentService(
+    os.getenv("GEMINI_API_KEY"),
+    embedding_backend=os.getenv("EMBEDDING_BACKEND", _model_backend),
+    llm_backend=os.getenv("LLM_BACKEND", _model_backend),
+)
@@ -0,0 +1,145 @@
+import bisect
+import threading
+
+# Seconds; spans sub-millisecond cache hits up to multi-second LLM calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Counts of things per request: retrieved chunks, context tokens
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+
+class Histogram:
+    """Thread-safe fixed-bucket histogram of durations in seconds."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            cumulative, running = {}, 0
+            for bound, count in zip(self.buckets + (float("inf"),), self._counts):
+                running += count
+                cumulative["+Inf" if bound == float("inf") else str(bound)] = running
+            return {"count": self._count, "sum": self._sum, "buckets": cumulative}
+
+
+class Counter:
+    """Thread-safe monotonically increasing counter."""
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class MetricFamily:
+    """A named metric with one child per combination of label values."""
+
+    def __init__(self, name: str, documentation: str, kind: str, label_names: tuple, factory):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.label_names = tuple(label_names)
+        self._factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        if len(values) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {values}")
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._factory())
+        return child
+
+    # Shortcuts for families without labels
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def children(self) -> dict:
+        return dict(self._children)
+
+
+class MetricsRegistry:
+    """Collects metrics and renders them in the Prometheus text exposition format.
+
+    Besides families owned by the registry, callbacks can expose values that
+    live elsewhere (cache counters, pool gauges, existing Histograms); they are
+    called at render time and return {label values tuple: value or Histogram}.
+    """
+
+    def __init__(self):
+        self._families = {}
+        self._callbacks = []  # (name, documentation, kind, label_names, fn)
+
+    def _register(self, family: MetricFamily) -> MetricFamily:
+        if family.name in self._families:
+            raise ValueError(f"Metric {family.name} is already registered")
+        self._families[family.name] = family
+        return family
+
+    def counter(self, name: str, documentation: str, labels: tuple = ()) -> MetricFamily:
+        return self._register(MetricFamily(name, documentation, "counter", labels, Counter))
+
+    def histogram(self, name: str, documentation: str, labels: tuple = (), buckets=DEFAULT_BUCKETS) -> MetricFamily:
+        return self._register(MetricFamily(name, documentation, "histogram", labels, lambda: Histogram(buckets)))
+
+    def register_callback(self, name: str, documentation: str, kind: str, fn, labels: tuple = ()):
+        self._callbacks.append((name, documentation, kind, tuple(labels), fn))
+
+    def render(self) -> str:
+        lines = []
+        families = [(f.name, f.documentation, f.kind, f.label_names, f.children) for f in self._families.values()]
+        for name, documentation, kind, label_names, fn in families + self._callbacks:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for values, metric in sorted(fn().items()):
+                labels = dict(zip(label_names, values))
+                if kind == "histogram":
+                    snapshot = metric.snapshot()
+                    for bound, count in snapshot["buckets"].items():
+                        lines.append(f"{name}_bucket{_format_labels({**labels, 'le': bound})} {count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(snapshot['sum'])}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {snapshot['count']}")
+                else:
+                    value = metric.value if isinstance(metric, Counter) else metric
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
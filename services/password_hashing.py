@@ -0,0 +1,50 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PasswordPoolSaturated(Exception):
+    pass
+
+
+class PasswordHasher:
+    """Runs bcrypt hashing and verification on a small dedicated thread pool.
+
+    bcrypt releases the GIL while it works, so threads keep it off the event
+    loop. At most max_workers + max_queue calls are admitted at once; beyond
+    that callers get PasswordPoolSaturated immediately instead of queueing.
+    """
+
+    def __init__(self, pwd_context, max_workers: int = 2, max_queue: int = 16):
+        self.pwd_context = pwd_context
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        self._in_flight = 0  # Only touched from the event loop thread
+        self.rejected = 0
+
+    async def _run(self, fn, *args):
+        if self._in_flight >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            raise PasswordPoolSaturated("Password hashing is at capacity, retry shortly.")
+        self._in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._in_flight -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.pwd_context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(self.pwd_context.verify, password, hashed_password)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self._in_flight,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
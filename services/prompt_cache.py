@@ -0,0 +1,81 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+SYSTEM_PROMPT = (
+    "You are a helpful AI assistant for the brand \"{brand_name}\".\n"
+    "Your purpose is: {purpose}.\n"
+    "Maintain a {tone} tone in all your responses.\n"
+    "Answer questions based ONLY on the context provided with each question. If you cannot find the answer in the context,\n"
+    "politely state that you don't have enough information and provide the fallback message: \"{fallback_message}\"."
+)
+# Per-request parts go after the system prompt, so every request for an agent starts
+# with the same bytes and the provider can serve that prefix from its context cache.
+TURN_TEMPLATE = "Context:\n{context}\n\nQuestion: {input}"
+
+PROMPT_FIELDS = ("name", "purpose", "tone", "fallback_message")
+
+
+def prompt_config_version(agent_config: dict) -> str:
+    fields = {field: agent_config.get(field) for field in PROMPT_FIELDS}
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def build_system_prompt(agent_config: dict) -> str:
+    return SYSTEM_PROMPT.format(
+        brand_name=agent_config.get("name", "your brand"),
+        purpose=agent_config.get("purpose", "answer questions"),
+        tone=agent_config.get("tone", "neutral"),
+        fallback_message=agent_config.get("fallback_message", "I'm sorry, I cannot answer that based on my current knowledge."),
+    )
+
+
+def build_prompt(agent_config: dict):
+    # Imported here: LangChain's prompt modules take about a second to load
+    from langchain_core.messages import SystemMessage
+    from langchain_core.prompts import ChatPromptTemplate
+    # A SystemMessage is used as-is rather than parsed as a template,
+    # so config text with braces needs no escaping.
+    return ChatPromptTemplate.from_messages([
+        SystemMessage(content=build_system_prompt(agent_config)),
+        ("human", TURN_TEMPLATE),
+    ])
+
+
+class PromptCache:
+    """LRU of compiled prompt | llm chains keyed by (agent_id, config version)."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_chain(self, agent_id: int, agent_config: dict, llm):
+        key = (agent_id, prompt_config_version(agent_config), id(llm))
+        with self._lock:
+            chain = self._entries.get(key)
+            if chain is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return chain
+            self.misses += 1
+        chain = build_prompt(agent_config) | llm
+        with self._lock:
+            self._entries[key] = chain
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return chain
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,96 @@
+import hashlib
+import itertools
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def response_cache_key(agent_config: dict, kb_version) -> str:
+    # Any edit to the agent or a new knowledge-base version yields a new key
+    payload = json.dumps({"config": agent_config, "kb_version": kb_version}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """In-memory semantic cache of chat answers.
+
+    A stored answer is returned when a new query's embedding has cosine
+    similarity >= similarity_threshold with a cached query for the same agent
+    and cache key. Entries expire after ttl_seconds and are evicted LRU once
+    max_entries is reached.
+    """
+
+    def __init__(self, similarity_threshold: float = 0.95, ttl_seconds: float = 3600, max_entries: int = 10000):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # entry_id -> (agent_id, key, unit vector, answer, created_at)
+        self._by_agent = {}  # agent_id -> set of entry_ids
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, agent_id: int, key: str, query_vector):
+        query = self._normalize(query_vector)
+        now = time.time()
+        with self._lock:
+            best_id, best_score = None, self.similarity_threshold
+            for entry_id in list(self._by_agent.get(agent_id, ())):
+                _, entry_key, vector, _, created_at = self._entries[entry_id]
+                if now - created_at > self.ttl_seconds:
+                    self._remove(entry_id)
+                    continue
+                if entry_key != key:
+                    continue
+                score = float(np.dot(query, vector))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id][3]
+
+    def store(self, agent_id: int, key: str, query_vector, answer: str):
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = (agent_id, key, self._normalize(query_vector), answer, time.time())
+            self._by_agent.setdefault(agent_id, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, agent_id: int):
+        with self._lock:
+            for entry_id in list(self._by_agent.get(agent_id, ())):
+                self._remove(entry_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _remove(self, entry_id):
+        agent_id = self._entries.pop(entry_id)[0]
+        agent_entries = self._by_agent.get(agent_id)
+        agent_entries.discard(entry_id)
+        if not agent_entries:
+            del self._by_agent[agent_id]
+
+    def _normalize(self, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
@@ -0,0 +1,98 @@
+import asyncio
+
+RRF_K = 60  # Standard reciprocal-rank-fusion constant; damps the weight of top ranks
+
+RETRIEVAL_DEFAULTS = {
+    "retrieval_k": 4,
+    "dense_weight": 1.0,
+    "sparse_weight": 1.0,
+    "max_context_tokens": 2000,
+}
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text; good enough for budgeting
+    return max(1, len(text) // 4)
+
+
+def reciprocal_rank_fusion(ranked_lists: list) -> list:
+    """Fuses (weight, [ids best first]) lists into one list of ids, best first."""
+    scores = {}
+    for weight, ids in ranked_lists:
+        for rank, doc_id in enumerate(ids, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight / (RRF_K + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def _fetch_k(k: int) -> int:
+    # Each retriever looks deeper than k so fusion has overlap to work with
+    return max(k * 3, 10)
+
+
+async def _fuse(vector_store, dense_docs_per_query: list, sparse_hits_per_query: list, k: int,
+                dense_weight: float, sparse_weight: float) -> list:
+    fused_per_query = [
+        reciprocal_rank_fusion([
+            (dense_weight, [doc.id for doc in dense_docs]),
+            (sparse_weight, [chunk_id for chunk_id, _ in sparse_hits]),
+        ])[:k]
+        for dense_docs, sparse_hits in zip(dense_docs_per_query, sparse_hits_per_query)
+    ]
+
+    docs_by_id = {doc.id: doc for dense_docs in dense_docs_per_query for doc in dense_docs}
+    missing = list({doc_id for fused in fused_per_query for doc_id in fused if doc_id not in docs_by_id})
+    if missing:
+        # Imported on use, like the vector store that has already loaded it by now
+        from langchain_core.documents import Document
+        # Chunks only the sparse index found are fetched from the store by id
+        result = await asyncio.to_thread(vector_store.get, ids=missing, include=["documents", "metadatas"])
+        for doc_id, text, metadata in zip(result["ids"], result["documents"], result["metadatas"]):
+            docs_by_id[doc_id] = Document(page_content=text, metadata=metadata or {}, id=doc_id)
+    return [[docs_by_id[doc_id] for doc_id in fused if doc_id in docs_by_id] for fused in fused_per_query]
+
+
+async def hybrid_retrieve(vector_store, sparse_index, query: str, k: int,
+                          dense_weight: float = 1.0, sparse_weight: float = 1.0, query_vector: list = None) -> list:
+    fetch_k = _fetch_k(k)
+    dense_docs = []
+    if dense_weight > 0:
+        if query_vector is not None:
+            dense_docs = await vector_store.asimilarity_search_by_vector(query_vector, k=fetch_k)
+        else:
+            dense_docs = await vector_store.asimilarity_search(query, k=fetch_k)
+    sparse_hits = []
+    if sparse_weight > 0 and sparse_index is not None:
+        sparse_hits = await asyncio.to_thread(sparse_index.search, query, fetch_k)
+    return (await _fuse(vector_store, [dense_docs], [sparse_hits], k, dense_weight, sparse_weight))[0]
+
+
+def _dense_search_many(vector_store, query_vectors: list, fetch_k: int) -> list:
+    from langchain_core.documents import Document
+    # One Chroma query for all vectors instead of one per question
+    result = vector_store._collection.query(
+        query_embeddings=query_vectors,
+        n_results=fetch_k,
+        include=["documents", "metadatas"],
+    )
+    return [
+        [Document(page_content=text, metadata=metadata or {}, id=doc_id)
+         for doc_id, text, metadata in zip(ids, texts, metadatas)]
+        for ids, texts, metadatas in zip(result["ids"], result["documents"], result["metadatas"])
+    ]
+
+
+def _sparse_search_many(sparse_index, queries: list, fetch_k: int) -> list:
+    return [sparse_index.search(query, fetch_k) for query in queries]
+
+
+async def hybrid_retrieve_many(vector_store, sparse_index, queries: list, query_vectors: list, k: int,
+                               dense_weight: float = 1.0, sparse_weight: float = 1.0) -> list:
+    """hybrid_retrieve for a batch of already embedded queries; returns one doc list per query."""
+    fetch_k = _fetch_k(k)
+    dense_docs_per_query = [[] for _ in queries]
+    if dense_weight > 0:
+        dense_docs_per_query = await asyncio.to_thread(_dense_search_many, vector_store, query_vectors, fetch_k)
+    sparse_hits_per_query = [[] for _ in queries]
+    if sparse_weight > 0 and sparse_index is not None:
+        sparse_hits_per_query = await asyncio.to_thread(_sparse_search_many, sparse_index, queries, fetch_k)
+    return await _fuse(vector_store, dense_docs_per_query, sparse_hits_per_query, k, dense_weight, sparse_weight)
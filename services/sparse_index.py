@@ -0,0 +1,99 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+
+INDEX_FILE = "bm25.json"
+_TOKEN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_PART = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> list:
+    # Codes like "SKU-1234" or "v2.1" are kept whole and also split into their
+    # parts, so both "SKU-1234" and "sku 1234" match them.
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        tokens.append(token)
+        parts = _PART.findall(token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class BM25Index:
+    """Okapi BM25 inverted index over a knowledge base's chunks, keyed by chunk id."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._doc_lengths = {}  # chunk_id -> token count
+        self._postings = {}  # term -> {chunk_id: term frequency}
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._doc_lengths)
+
+    def add(self, chunk_id: str, text: str):
+        if chunk_id in self._doc_lengths:
+            self.remove_many([chunk_id])
+        tokens = tokenize(text)
+        self._doc_lengths[chunk_id] = len(tokens)
+        self._total_length += len(tokens)
+        for term, freq in Counter(tokens).items():
+            self._postings.setdefault(term, {})[chunk_id] = freq
+
+    def remove_many(self, chunk_ids: list):
+        removed = set()
+        for chunk_id in chunk_ids:
+            length = self._doc_lengths.pop(chunk_id, None)
+            if length is not None:
+                self._total_length -= length
+                removed.add(chunk_id)
+        if not removed:
+            return
+        # One pass over the postings rather than one per removed chunk
+        for term in list(self._postings):
+            docs = self._postings[term]
+            for chunk_id in removed.intersection(docs):
+                del docs[chunk_id]
+            if not docs:
+                del self._postings[term]
+
+    def search(self, query: str, k: int) -> list:
+        """Returns up to k (chunk_id, score) pairs, best first."""
+        if not self._doc_lengths:
+            return []
+        n_docs = len(self._doc_lengths)
+        avg_length = self._total_length / n_docs or 1
+        scores = Counter()
+        for term in set(tokenize(query)):
+            docs = self._postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for chunk_id, freq in docs.items():
+                norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[chunk_id] / avg_length)
+                scores[chunk_id] += idf * freq * (self.k1 + 1) / (freq + norm)
+        return scores.most_common(k)
+
+    def save(self, directory: str):
+        path = os.path.join(directory, INDEX_FILE)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"doc_lengths": self._doc_lengths, "postings": self._postings}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, directory: str):
+        """Returns None when the directory has no index yet."""
+        try:
+            with open(os.path.join(directory, INDEX_FILE)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        index = cls()
+        index._doc_lengths = data["doc_lengths"]
+        index._postings = data["postings"]
+        index._total_length = sum(index._doc_lengths.values())
+        return index
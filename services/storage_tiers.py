@@ -0,0 +1,177 @@
+import os
+import re
+import shutil
+import tarfile
+import threading
+import time
+
+from services.kb_versions import CURRENT_FILE
+from services.metrics import Histogram
+from services.vector_store_cache import estimate_store_bytes
+
+ARCHIVE_SUFFIX = ".tar.gz"
+LAST_ACCESS_FILE = ".last_access"  # A dot-file, so KnowledgeBaseVersions.prune leaves it alone
+TOUCH_PERSIST_SECONDS = 60
+_ARCHIVED_VERSION = re.compile(r"^v(\d+)$")
+
+
+class TieredStorage:
+    """Moves idle agent knowledge bases between the hot tier and compressed archives.
+
+    The hot tier is the versioned KnowledgeBaseVersions tree that chats read.
+    When an agent's store hasn't been used for idle_seconds, its current version
+    is packed into one tar.gz in archive_dir and removed from the hot tier. The
+    next chat or upload unpacks it again. The archive and rehydrate methods block,
+    and callers must hold the agent's KB lock.
+
+    Archive state and access times are read from disk, so worker processes
+    sharing both directories see each other's archiving and chats. Without an
+    archive_dir nothing is archived: an archive is the only copy of a store,
+    so it must live somewhere that persists.
+    """
+
+    def __init__(self, kb_versions, archive_dir: str = None, idle_seconds: float = 86400):
+        self.kb_versions = kb_versions
+        self.archive_dir = archive_dir
+        self.idle_seconds = idle_seconds
+        self._last_access = {}  # agent_id -> timestamp
+        self._last_persisted = {}  # agent_id -> timestamp of the last LAST_ACCESS_FILE update
+        self._lock = threading.Lock()
+        self.rehydration_seconds = Histogram()
+        self.archived_count = 0
+        self.rehydrated_count = 0
+
+    def archive_path(self, agent_id: int) -> str:
+        return os.path.join(self.archive_dir, f"{agent_id}{ARCHIVE_SUFFIX}")
+
+    @property
+    def enabled(self) -> bool:
+        return self.archive_dir is not None
+
+    def is_archived(self, agent_id: int) -> bool:
+        return self.enabled and os.path.exists(self.archive_path(agent_id))
+
+    def archived_agents(self) -> list:
+        if not self.enabled:
+            return []
+        try:
+            names = os.listdir(self.archive_dir)
+        except OSError:
+            return []
+        return [
+            int(name[:-len(ARCHIVE_SUFFIX)])
+            for name in names
+            if name.endswith(ARCHIVE_SUFFIX) and name[:-len(ARCHIVE_SUFFIX)].isdigit()
+        ]
+
+    def touch(self, agent_id: int):
+        now = time.time()
+        self._last_access[agent_id] = now
+        if now - self._last_persisted.get(agent_id, 0) < TOUCH_PERSIST_SECONDS:
+            return
+        # Persisted now and then, so a restart doesn't make every store look idle
+        self._last_persisted[agent_id] = now
+        path = os.path.join(self.kb_versions.agent_dir(agent_id), LAST_ACCESS_FILE)
+        try:
+            with open(path, "a"):
+                pass
+            os.utime(path, (now, now))
+        except OSError:
+            pass  # No store for this agent yet
+
+    def last_access(self, agent_id: int):
+        # The files' times cover other workers and uses before this process started
+        times = [self._last_access[agent_id]] if agent_id in self._last_access else []
+        agent_dir = self.kb_versions.agent_dir(agent_id)
+        for name in (LAST_ACCESS_FILE, CURRENT_FILE):
+            try:
+                times.append(os.path.getmtime(os.path.join(agent_dir, name)))
+            except OSError:
+                continue
+        return max(times, default=None)
+
+    def is_idle(self, agent_id: int, now: float = None) -> bool:
+        if self.is_archived(agent_id) or self.kb_versions.current_version(agent_id) is None:
+            return False
+        last_access = self.last_access(agent_id)
+        return last_access is not None and (now or time.time()) - last_access >= self.idle_seconds
+
+    def idle_agents(self) -> list:
+        if not self.enabled:
+            return []
+        try:
+            names = os.listdir(self.kb_versions.base_path)
+        except OSError:
+            return []
+        now = time.time()
+        return [int(name) for name in names if name.isdigit() and self.is_idle(int(name), now)]
+
+    def archive(self, agent_id: int):
+        if not self.enabled:
+            raise RuntimeError("No archive directory is configured.")
+        version = self.kb_versions.current_version(agent_id)
+        if version is None:
+            return
+        agent_dir = self.kb_versions.agent_dir(agent_id)
+        # Created on first use, not when the service is constructed
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = self.archive_path(agent_id)
+        tmp_path = f"{path}.tmp"
+        with tarfile.open(tmp_path, "w:gz") as tar:
+            tar.add(self.kb_versions.version_path(agent_id, version), arcname=f"v{version}")
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._last_access.pop(agent_id, None)
+            self._last_persisted.pop(agent_id, None)
+            self.archived_count += 1
+        shutil.rmtree(agent_dir, ignore_errors=True)
+
+    def rehydrate(self, agent_id: int) -> bool:
+        """Unpacks an archived store into the hot tier; returns False if it wasn't archived."""
+        if not self.is_archived(agent_id):
+            return False
+        start = time.perf_counter()
+        agent_dir = self.kb_versions.agent_dir(agent_id)
+        staging = f"{agent_dir}.rehydrating"
+        shutil.rmtree(staging, ignore_errors=True)
+        with tarfile.open(self.archive_path(agent_id)) as tar:
+            if hasattr(tarfile, "data_filter"):
+                tar.extractall(staging, filter="data")
+            else:
+                tar.extractall(staging)
+        (name,) = os.listdir(staging)
+        # Unpacked as the next version, not the archived one: Chroma keeps one client
+        # per path for the life of the process, and the old path's client is stale.
+        version = int(_ARCHIVED_VERSION.match(name).group(1)) + 1
+        # Leftovers of a crash between packing and removing the hot copy are superseded
+        shutil.rmtree(agent_dir, ignore_errors=True)
+        os.makedirs(agent_dir)
+        os.rename(os.path.join(staging, name), self.kb_versions.version_path(agent_id, version))
+        os.rmdir(staging)
+        self.kb_versions.publish(agent_id, version)
+        os.remove(self.archive_path(agent_id))
+        with self._lock:
+            self.rehydrated_count += 1
+        self.rehydration_seconds.observe(time.perf_counter() - start)
+        self.touch(agent_id)
+        return True
+
+    def stats(self) -> dict:
+        # Walks both trees; call off the event loop
+        archive_bytes = 0
+        archived_agents = self.archived_agents()
+        for agent_id in archived_agents:
+            try:
+                archive_bytes += os.path.getsize(self.archive_path(agent_id))
+            except OSError:
+                pass
+        return {
+            "archive_dir": self.archive_dir,
+            "hot_bytes": estimate_store_bytes(self.kb_versions.base_path),
+            "archive_bytes": archive_bytes,
+            "archived_agents": len(archived_agents),
+            "idle_seconds": self.idle_seconds,
+            "archived": self.archived_count,
+            "rehydrated": self.rehydrated_count,
+            "rehydration_seconds": self.rehydration_seconds.snapshot(),
+        }
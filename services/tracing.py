@@ -0,0 +1,134 @@
+import contextlib
+import json
+import logging
+import re
+import time
+import uuid
+from contextvars import ContextVar
+
+from starlette.datastructures import MutableHeaders
+
+from services.metrics import REGISTRY
+
+request_id_var = ContextVar("request_id", default=None)
+_stage_timings = ContextVar("stage_timings", default=None)  # stage -> seconds, for Server-Timing
+_CLIENT_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "http_requests_total", "HTTP requests by method, route template and status.", labels=("method", "route", "status")
+)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request duration, including streamed bodies.", labels=("method", "route")
+)
+
+access_logger = logging.getLogger("access")
+
+
+def current_request_id():
+    return request_id_var.get()
+
+
+@contextlib.contextmanager
+def stage(histogram, name: str):
+    """Times a block into histogram.labels(name) and the current request's Server-Timing."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        histogram.labels(name).observe(elapsed)
+        timings = _stage_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; fields passed as extra={"fields": {...}} are merged in."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level: str = "INFO", json_format: bool = True):
+    # Leaves an existing root configuration (a test runner, an embedding app) alone
+    handler = logging.StreamHandler()
+    handler.addFilter(RequestIdFilter())
+    handler.setFormatter(
+        JsonFormatter() if json_format
+        else logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s")
+    )
+    logging.basicConfig(level=level.upper(), handlers=[handler])
+
+
+class RequestContextMiddleware:
+    """Gives each HTTP request an id, metrics, an access log line and optionally Server-Timing.
+
+    The id comes from a well-formed X-Request-ID header or is generated, and is
+    echoed back in the response. Plain ASGI rather than BaseHTTPMiddleware, so
+    streamed responses pass straight through.
+    """
+
+    def __init__(self, app, server_timing: bool = False):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        client_id = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+        request_id = client_id if _CLIENT_REQUEST_ID.match(client_id) else uuid.uuid4().hex
+        timings = {}
+        request_id_token = request_id_var.set(request_id)
+        timings_token = _stage_timings.set(timings)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_headers(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Request-ID", request_id)
+                if self.server_timing:
+                    # Only stages finished before the headers go out; streamed tokens come later
+                    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+                    entries.append(f"total;dur={(time.perf_counter() - start) * 1000:.1f}")
+                    headers.append("Server-Timing", ", ".join(entries))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            duration = time.perf_counter() - start
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUESTS.labels(scope["method"], route, status).inc()
+            HTTP_REQUEST_SECONDS.labels(scope["method"], route).observe(duration)
+            access_logger.info(
+                "%s %s %s", scope["method"], scope["path"], status,
+                extra={"fields": {
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "route": route,
+                    "status": status,
+                    "duration_ms": round(duration * 1000, 2),
+                }},
+            )
+            _stage_timings.reset(timings_token)
+            request_id_var.reset(request_id_token)
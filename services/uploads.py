@@ -0,0 +1,133 @@
+import asyncio
+import os
+import tempfile
+
+from python_multipart.multipart import MultipartParseError, MultipartParser, parse_options_header
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadTooLarge(UploadError):
+    pass
+
+
+class UnsupportedUploadType(UploadError):
+    pass
+
+
+class _FilePartReader:
+    """Multipart parser callbacks that keep only the data of the first file part named field."""
+
+    def __init__(self, field: str):
+        self.field = field.encode()
+        self.filename = None  # Set once the wanted part's headers are parsed
+        self.data = []  # That part's data parsed since the caller last took it
+        self.size = 0
+        self.complete = False
+        self._in_part = False
+        self._header_field = b""
+        self._header_value = b""
+        self._disposition = b""
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def take(self) -> bytes:
+        data = b"".join(self.data)
+        self.data.clear()
+        self.size = 0
+        return data
+
+    def on_part_begin(self):
+        self._disposition = b""
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        if self._header_field.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_field = self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        if self.filename is None and options.get(b"name") == self.field and b"filename" in options:
+            self.filename = options[b"filename"].decode("utf-8", "replace")
+            self._in_part = True
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self._in_part:
+            self.data.append(data[start:end])
+            self.size += end - start
+
+    def on_part_end(self):
+        if self._in_part:
+            self._in_part = False
+            self.complete = True
+
+
+async def receive_upload(
+    request, field: str, directory: str, max_bytes: int, chunk_bytes: int, extensions: tuple = None
+) -> tuple:
+    """Streams the file in a multipart/form-data request body to a new file in directory.
+
+    Returns (file_path, filename). The body is parsed as it arrives, so the
+    upload is written to disk once and never held in memory beyond about
+    chunk_bytes; it is abandoned with UploadTooLarge as soon as the file
+    passes max_bytes. If extensions is given, a file whose name has another
+    extension is refused with UnsupportedUploadType before any of it is
+    written. Form fields other than field are ignored.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not params.get(b"boundary"):
+        raise UploadError("Expected a multipart/form-data upload.")
+    reader = _FilePartReader(field)
+    parser = MultipartParser(params[b"boundary"], reader.callbacks())
+    os.makedirs(directory, exist_ok=True)
+    f = file_path = None
+    size = 0
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if reader.filename is not None and f is None:
+                extension = os.path.splitext(reader.filename)[1].lower()
+                if extensions is not None and extension not in extensions:
+                    raise UnsupportedUploadType(f"Unsupported file type {extension or '(none)'}; expected {', '.join(extensions)}.")
+                # A unique name per upload; the extension picks the parser
+                fd, file_path = tempfile.mkstemp(suffix=extension, dir=directory)
+                f = os.fdopen(fd, "wb")
+            if reader.size >= chunk_bytes or (reader.complete and reader.size):
+                data = reader.take()
+                size += len(data)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"File is larger than {max_bytes // (1024 * 1024)} MB.")
+                await asyncio.to_thread(f.write, data)
+            if reader.complete:
+                # The rest of the body is other fields, which are ignored
+                break
+        if f is None:
+            raise UploadError(f"No file was uploaded in the '{field}' field.")
+        if not reader.complete:
+            raise UploadError("The upload ended before the file was complete.")
+        f.close()
+    except BaseException as e:
+        if f is not None:
+            f.close()
+            os.remove(file_path)
+        if isinstance(e, MultipartParseError):
+            raise UploadError("The upload is not valid multipart/form-data.") from e
+        raise
+    return file_path, reader.filename
@@ -0,0 +1,163 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+def estimate_store_bytes(path: str) -> int:
+    # The HNSW segments and the SQLite file are what Chroma pages into memory,
+    # so their on-disk size is a reasonable proxy for the resident cost.
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class VectorStoreCache:
+    """Thread-safe LRU registry of open per-agent vector stores.
+
+    Bounded by entry count and by the estimated memory of the open stores.
+    Dropping a store from the cache doesn't free it: its client keeps the
+    files and indexes open until closed. So stores are checked out while in
+    use, and one that is evicted or invalidated is passed to close() as soon
+    as no checkout holds it any more.
+    """
+
+    def __init__(self, max_entries: int = 32, max_bytes: int = 512 * 1024 * 1024, close=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._close = close
+        self._entries = OrderedDict()  # agent_id -> (path, store, size_bytes)
+        self._checkouts = {}  # id(store) -> [store, checkouts in flight]
+        self._retired = set()  # ids of checked-out stores to close on their last check-in
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.closed = 0
+
+    def checkout(self, agent_id: int, path: str):
+        """Returns the cached store for path, checked out, or None; pair with checkin()."""
+        with self._lock:
+            entry = self._entries.get(agent_id)
+            if entry is None or entry[0] != path:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(agent_id)
+            self.hits += 1
+            self._checkout(entry[1])
+            return entry[1]
+
+    def checkin(self, store):
+        with self._lock:
+            holder = self._checkouts[id(store)]
+            holder[1] -= 1
+            if holder[1]:
+                return
+            del self._checkouts[id(store)]
+            if id(store) not in self._retired:
+                return
+            self._retired.discard(id(store))
+        self._close_all([store])
+
+    def put(self, agent_id: int, path: str, store, size_bytes: int = None, checkout: bool = False):
+        """Caches store as the agent's entry and returns the store to use, checked out if asked.
+
+        If another caller cached a store for the same path first, that one is
+        returned instead and the given store is closed. A store it replaces,
+        such as a superseded KB version, is closed once no checkout holds it.
+        """
+        if size_bytes is None:
+            size_bytes = estimate_store_bytes(path)
+        to_close = []
+        with self._lock:
+            entry = self._entries.get(agent_id)
+            if entry is not None and entry[0] == path and entry[1] is not store:
+                # Keep a single handle per path
+                self._entries.move_to_end(agent_id)
+                to_close.append(store)
+                store = entry[1]
+            else:
+                replaced = self._pop(agent_id)
+                if replaced is not None and replaced[1] is not store:
+                    to_close.extend(self._retire(replaced[1]))
+                self._entries[agent_id] = (path, store, size_bytes)
+                self._total_bytes += size_bytes
+                to_close.extend(self._evict())
+            if checkout:
+                self._checkout(store)
+        self._close_all(to_close)
+        return store
+
+    def invalidate(self, agent_id: int):
+        """Drops the agent's entry, closing its store once no checkout holds it."""
+        with self._lock:
+            entry = self._pop(agent_id)
+            to_close = self._retire(entry[1]) if entry else []
+        self._close_all(to_close)
+        return entry is not None
+
+    def clear(self):
+        with self._lock:
+            to_close = [store for _, store, _ in self._entries.values()]
+            self._entries.clear()
+            self._total_bytes = 0
+            to_close = [closable for store in to_close for closable in self._retire(store)]
+        self._close_all(to_close)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "estimated_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "checked_out": len(self._checkouts),
+                "awaiting_close": len(self._retired),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "closed": self.closed,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _checkout(self, store):
+        self._checkouts.setdefault(id(store), [store, 0])[1] += 1
+
+    def _retire(self, store) -> list:
+        # Returns the store if it can be closed now; otherwise its last check-in closes it
+        if id(store) in self._checkouts:
+            self._retired.add(id(store))
+            return []
+        return [store]
+
+    def _close_all(self, stores: list):
+        # Outside the lock: closing a client can take a while
+        for store in stores:
+            if self._close is not None:
+                self._close(store)
+            with self._lock:
+                self.closed += 1
+
+    def _pop(self, agent_id: int):
+        entry = self._entries.pop(agent_id, None)
+        if entry is not None:
+            self._total_bytes -= entry[2]
+        return entry
+
+    def _evict(self) -> list:
+        # Always keep the most recently used entry, even if it alone exceeds max_bytes.
+        to_close = []
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes
+        ):
+            _, (_, store, size_bytes) = self._entries.popitem(last=False)
+            self._total_bytes -= size_bytes
+            self.evictions += 1
+            to_close.extend(self._retire(store))
+        return to_close
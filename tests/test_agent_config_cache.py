@@ -0,0 +1,56 @@
+import asyncio
+
+from services.agent_config_cache import AgentConfigCache
+
+
+class FakeAgents:
+    """Stands in for the agents table that worker processes share."""
+
+    def __init__(self):
+        self.rows = {1: {"id": 1, "tone": "Formal", "config_version": 1}}
+        self.loads = 0
+
+    async def load(self, agent_id):
+        self.loads += 1
+        row = self.rows.get(agent_id)
+        return dict(row) if row else None
+
+    async def version(self, agent_id):
+        row = self.rows.get(agent_id)
+        return row["config_version"] if row else None
+
+    def edit(self, agent_id, **fields):
+        self.rows[agent_id].update(fields, config_version=self.rows[agent_id]["config_version"] + 1)
+
+
+def test_edit_in_another_worker_is_picked_up_after_the_ttl():
+    agents = FakeAgents()
+    changed = []
+    cache = AgentConfigCache(ttl_seconds=0, on_change=changed.append)
+
+    async def run():
+        assert (await cache.get(1, agents.load, agents.version))["tone"] == "Formal"
+        # Unchanged: only the version is read
+        assert (await cache.get(1, agents.load, agents.version))["tone"] == "Formal"
+        assert agents.loads == 1 and cache.stats()["revalidations"] == 1
+        agents.edit(1, tone="Friendly")
+        assert (await cache.get(1, agents.load, agents.version))["tone"] == "Friendly"
+        assert agents.loads == 2 and changed == [1]
+        del agents.rows[1]
+        assert await cache.get(1, agents.load, agents.version) is None
+        assert changed == [1, 1] and cache.stats()["entries"] == 0
+
+    asyncio.run(run())
+
+
+def test_entries_within_the_ttl_skip_the_database():
+    agents = FakeAgents()
+    cache = AgentConfigCache(ttl_seconds=60)
+
+    async def run():
+        await cache.get(1, agents.load, agents.version)
+        agents.edit(1, tone="Friendly")
+        assert (await cache.get(1, agents.load, agents.version))["tone"] == "Formal"
+        assert agents.loads == 1
+
+    asyncio.run(run())
@@ -0,0 +1,55 @@
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from services.context_assembly import _merge_neighbours, assemble_context
+
+TEXT = " ".join(f"Sentence {i} explains how widget {i} is installed and serviced." for i in range(60))
+
+
+def _chunk(text: str, start: int, source: str = "kb.txt", page: int = 0) -> Document:
+    return Document(page_content=text, metadata={"source": source, "page": page, "start_index": start})
+
+
+def test_overlapping_chunks_merge_back_into_the_source_text():
+    splitter = RecursiveCharacterTextSplitter(chunk_size=300, chunk_overlap=80, add_start_index=True)
+    chunks = splitter.split_documents([Document(page_content=TEXT, metadata={"source": "kb.txt", "page": 0})])
+    assert len(chunks) > 3
+    # Retrieved out of order, as ranking would return them
+    blocks = _merge_neighbours(list(reversed(chunks)))
+    assert blocks == [[0, TEXT]]
+
+
+def test_adjacent_chunks_join_across_stripped_whitespace():
+    first, second = TEXT[:100], TEXT[101:200]  # The splitter dropped the space at 100
+    assert _merge_neighbours([_chunk(second, 101), _chunk(first, 0)]) == [[0, first + "\n" + second]]
+
+
+def test_contained_chunk_adds_nothing():
+    outer, inner = TEXT[:300], TEXT[50:120]
+    assert _merge_neighbours([_chunk(inner, 50), _chunk(outer, 0)]) == [[0, outer]]
+
+
+def test_distant_chunks_and_other_pages_stay_separate():
+    blocks = _merge_neighbours([
+        _chunk(TEXT[500:600], 500),
+        _chunk(TEXT[:100], 0),
+        _chunk(TEXT[100:200], 100, page=1),
+        Document(page_content="no offsets"),
+        _chunk(TEXT[95:150], 95),
+    ])
+    assert sorted(blocks) == [[0, TEXT[500:600]], [1, TEXT[:150]], [2, TEXT[100:200]], [3, "no offsets"]]
+
+
+def test_context_drops_near_duplicates_and_keeps_rank_order():
+    duplicate = _chunk(TEXT[:400], 0, source="copy.txt")
+    docs = [_chunk(TEXT[1000:1200], 1000), _chunk(TEXT[:400], 0), duplicate]
+    context, stats = assemble_context(docs, max_tokens=1000)
+    assert context == TEXT[1000:1200] + "\n\n" + TEXT[:400]
+    assert stats["retrieved_chunks"] == 3 and stats["context_blocks"] == 2
+
+
+def test_context_is_cut_to_the_token_budget():
+    docs = [_chunk(TEXT[:2000], 0), _chunk(TEXT[3000:3400], 3000)]
+    context, stats = assemble_context(docs, max_tokens=100)
+    assert stats["context_blocks"] == 1 and stats["context_tokens"] <= 100
+    assert TEXT.startswith(context) and len(context) > 300
@@ -0,0 +1,44 @@
+import asyncio
+import sqlite3
+
+from services.backends import HashingEmbeddings
+from services.embedding_cache import CachedEmbeddings, EmbeddingCache
+
+
+def _stored_bytes(path) -> int:
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+
+def test_limit_holds_across_processes_sharing_the_file(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite3")
+    # Two caches on one file, as two worker processes would have
+    caches = [EmbeddingCache(path, max_bytes=40_000), EmbeddingCache(path, max_bytes=40_000)]
+    for i in range(40):
+        caches[i % 2].put_many("model", {f"hash-{i}": [0.5] * 250})  # 1000 bytes each
+    assert _stored_bytes(path) <= 40_000
+    assert caches[1].stats()["stored_bytes"] == _stored_bytes(path)
+    # The most recent vectors survive eviction
+    assert caches[0].get_many("model", ["hash-39"])
+
+
+def test_size_of_an_existing_cache_is_counted_on_open(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite3")
+    EmbeddingCache(path).put_many("model", {"a": [1.0] * 10, "b": [2.0] * 10})
+    assert EmbeddingCache(path).stats()["stored_bytes"] == 80
+
+
+def test_async_embeddings_are_served_from_the_cache(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"))
+    embeddings = CachedEmbeddings(HashingEmbeddings(), cache, "hashing")
+
+    async def run():
+        first = await embeddings.aembed_queries(["refund policy", "shipping times"])
+        assert await embeddings.aembed_query("refund policy") == first[0]
+        documents = await embeddings.aembed_documents(["refund policy"])
+        # Documents and queries are cached under separate keys
+        assert cache.stats()["misses"] == 3
+        assert await embeddings.aembed_documents(["refund policy"]) == documents
+
+    asyncio.run(run())
+    assert cache.stats()["hits"] == 2
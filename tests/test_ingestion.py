@@ -0,0 +1,43 @@
+import pytest
+
+from services import ingestion
+from services.ingestion import count_pages, iter_pages
+
+
+@pytest.fixture(autouse=True)
+def small_sections(monkeypatch):
+    monkeypatch.setattr(ingestion, "TXT_SECTION_BYTES", 1000)
+    monkeypatch.setattr(ingestion, "TXT_BREAK_SEARCH_BYTES", 100)
+
+
+def _sections(path):
+    return [text for _, text in iter_pages(str(path), 0, count_pages(str(path)))]
+
+
+def test_txt_sections_end_at_line_breaks(tmp_path):
+    path = tmp_path / "kb.txt"
+    text = "".join(f"line {i} of the knowledge base\n" for i in range(300))
+    path.write_text(text)
+    sections = _sections(path)
+    assert "".join(sections) == text
+    assert all(section.endswith("\n") for section in sections)
+
+
+@pytest.mark.parametrize("separator", ["\r", " "])
+def test_txt_sections_without_line_feeds_stay_bounded(tmp_path, separator):
+    path = tmp_path / "kb.txt"
+    text = separator.join(f"sentence {i}" for i in range(1000))
+    path.write_text(text, newline="")
+    sections = _sections(path)
+    assert "".join(sections) == text
+    assert max(len(section) for section in sections) <= 1100
+    assert all(section.endswith(separator) for section in sections[:-1])
+
+
+def test_txt_hard_cut_keeps_utf8_characters_whole(tmp_path):
+    path = tmp_path / "kb.txt"
+    text = "x" + "é" * 3000  # Two bytes each after the first, so boundaries land mid-character
+    path.write_text(text, encoding="utf-8")
+    sections = _sections(path)
+    assert "".join(sections) == text
+    assert max(len(section.encode()) for section in sections) <= 1100
@@ -0,0 +1,113 @@
+import asyncio
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from services.llm_service import LLMAgentService
+from services.sparse_index import INDEX_FILE
+
+
+def _write_kb(path, seed: int):
+    lines = [f"Section {seed}-{i}: widget {i} ships within {i % 7 + 1} days and carries a {i % 3 + 1} year warranty." for i in range(120)]
+    path.write_text("\n".join(lines))
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setenv("VECTOR_STORE_DIR", str(tmp_path / "chroma_db"))
+    monkeypatch.setenv("VECTOR_STORE_ARCHIVE_DIR", str(tmp_path / "kb_archive"))
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", str(tmp_path / "embedding_cache.sqlite3"))
+    monkeypatch.setenv("KB_EMBED_BATCH_SIZE", "4")
+    monkeypatch.setenv("KB_PARSE_WORKERS", "1")
+    service = LLMAgentService(None, embedding_backend="fake", llm_backend="fake")
+    yield service
+    service.shutdown()
+
+
+def test_upload_after_failed_build(service, tmp_path):
+    kb = tmp_path / "kb.txt"
+    _write_kb(kb, seed=1)
+    embed_chunks = service._embed_chunks
+    calls = 0
+
+    async def failing_embed_chunks(*args, **kwargs):
+        nonlocal calls
+        calls += 1
+        if calls == 2:
+            raise RuntimeError("embedding provider unavailable")
+        return await embed_chunks(*args, **kwargs)
+
+    async def run():
+        service._embed_chunks = failing_embed_chunks
+        with pytest.raises(RuntimeError, match="embedding provider unavailable"):
+            await service.process_knowledge_base(1, str(kb))
+        assert service.kb_versions.current_version(1) is None
+
+        service._embed_chunks = embed_chunks
+        path = await service.process_knowledge_base(1, str(kb))
+        assert service.kb_versions.current_path(1) == path
+
+        # And the agent keeps accepting uploads after that
+        _write_kb(kb, seed=2)
+        path = await service.process_knowledge_base(1, str(kb))
+        assert service.kb_versions.current_path(1) == path
+        async with service._agent_store(1, path) as (vector_store, _):
+            assert await vector_store.asimilarity_search("widget warranty", k=2)
+
+    asyncio.run(run())
+
+
+def test_superseded_version_is_closed(service, tmp_path):
+    kb = tmp_path / "kb.txt"
+
+    async def run():
+        _write_kb(kb, seed=1)
+        old_path = await service.process_knowledge_base(1, str(kb))
+        async with service._agent_store(1, old_path):
+            _write_kb(kb, seed=2)
+            new_path = await service.process_knowledge_base(1, str(kb))
+            # Still held by the request above
+            assert service.vector_store_cache.stats()["awaiting_close"] == 1
+        stats = service.vector_store_cache.stats()
+        assert (stats["entries"], stats["awaiting_close"], stats["closed"]) == (1, 0, 1)
+        async with service._agent_store(1, new_path) as (vector_store, _):
+            assert await vector_store.asimilarity_search("widget warranty", k=2)
+
+    asyncio.run(run())
+
+
+def test_upload_after_parse_worker_died(service, tmp_path):
+    kb = tmp_path / "kb.txt"
+    _write_kb(kb, seed=1)
+
+    async def run():
+        # A worker exiting abruptly, as an OOM kill would, breaks the pool
+        with pytest.raises(BrokenProcessPool):
+            await service._parse(os._exit, 1)
+        assert service.parse_pool_healthy()
+        path = await service.process_knowledge_base(1, str(kb))
+        assert service.kb_versions.current_path(1) == path
+
+    asyncio.run(run())
+
+
+def test_store_without_sparse_index(service, tmp_path):
+    kb = tmp_path / "kb.txt"
+
+    async def run():
+        _write_kb(kb, seed=1)
+        path = await service.process_knowledge_base(1, str(kb))
+        # As left by a version built before hybrid retrieval
+        os.remove(os.path.join(path, INDEX_FILE))
+        service.vector_store_cache.clear()
+        async with service._agent_store(1, path) as (_, sparse_index):
+            assert sparse_index.search("widget warranty", 2)
+        # Indexed in memory; the published version isn't written to
+        assert not os.path.exists(os.path.join(path, INDEX_FILE))
+
+        _write_kb(kb, seed=2)
+        path = await service.process_knowledge_base(1, str(kb))
+        assert os.path.exists(os.path.join(path, INDEX_FILE))
+
+    asyncio.run(run())
@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+
+from services.llm_gateway import GatewayOverloaded, LLMGateway
+
+
+class Throttled(Exception):
+    pass
+
+
+def test_calls_beyond_the_queue_are_rejected():
+    gateway = LLMGateway(max_concurrency=2, per_agent_concurrency=2, max_queue=1)
+    release = asyncio.Event()
+
+    async def hold():
+        await release.wait()
+        return "done"
+
+    async def run():
+        admitted = [asyncio.ensure_future(gateway.call(agent_id, hold)) for agent_id in (1, 2, 3)]
+        await asyncio.sleep(0)
+        assert gateway.stats()["active"] == 2 and gateway.stats()["queued"] == 1
+        with pytest.raises(GatewayOverloaded):
+            await gateway.call(4, hold)
+        release.set()
+        assert await asyncio.gather(*admitted) == ["done"] * 3
+        # Slots are given back, so new calls are admitted again
+        assert await gateway.call(4, hold) == "done"
+
+    asyncio.run(run())
+    assert gateway.rejected == 1
+
+
+def test_per_agent_limit_leaves_room_for_other_agents():
+    gateway = LLMGateway(max_concurrency=4, per_agent_concurrency=1, max_queue=8)
+    running = {1: 0, 2: 0}
+    peak = {1: 0, 2: 0}
+
+    def call(agent_id):
+        async def fn():
+            running[agent_id] += 1
+            peak[agent_id] = max(peak[agent_id], running[agent_id])
+            await asyncio.sleep(0.01)
+            running[agent_id] -= 1
+        return gateway.call(agent_id, fn)
+
+    async def run():
+        await asyncio.gather(*(call(1) for _ in range(3)), call(2))
+
+    asyncio.run(run())
+    assert peak == {1: 1, 2: 1}
+
+
+def test_retryable_errors_are_retried_then_raised():
+    gateway = LLMGateway(max_retries=2, backoff_base=0, retry_on=(Throttled,))
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise Throttled()
+        return "ok"
+
+    async def always_throttled():
+        raise Throttled()
+
+    async def broken():
+        attempts.append(1)
+        raise ValueError("not retried")
+
+    async def run():
+        assert await gateway.call(1, flaky) == "ok"
+        with pytest.raises(Throttled):
+            await gateway.call(1, always_throttled)
+        attempts.clear()
+        with pytest.raises(ValueError):
+            await gateway.call(1, broken)
+        assert len(attempts) == 1
+
+    asyncio.run(run())
+    assert gateway.retries == 4
+
+
+def test_same_key_shares_one_call_even_if_a_caller_leaves():
+    gateway = LLMGateway()
+    calls = []
+
+    async def answer():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return "shared"
+
+    async def run():
+        callers = [asyncio.ensure_future(gateway.call(1, answer, key="q")) for _ in range(3)]
+        await asyncio.sleep(0)
+        callers[0].cancel()
+        assert await asyncio.gather(*callers[1:]) == ["shared", "shared"]
+        # Finished calls aren't shared with later ones
+        assert await gateway.call(1, answer, key="q") == "shared"
+
+    asyncio.run(run())
+    assert len(calls) == 2 and gateway.coalesced == 2
+
+
+def test_shared_call_errors_reach_every_caller():
+    gateway = LLMGateway()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("provider down")
+
+    async def run():
+        results = await asyncio.gather(*(gateway.call(1, fail, key="q") for _ in range(2)), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+
+    asyncio.run(run())
+
+
+def test_rate_limit_allows_a_burst_then_spaces_calls():
+    gateway = LLMGateway(rate_per_second=50, burst=2)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for _ in range(4):
+            await gateway.throttle()
+        return loop.time() - start
+
+    # Two calls from the burst, then two more at 50 per second
+    assert asyncio.run(run()) >= 0.035
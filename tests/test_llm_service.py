@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessage
+
+from services.llm_service import RAG_ANSWERS, RAG_LLM_TOKENS, LLMAgentService
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setenv("VECTOR_STORE_DIR", str(tmp_path / "chroma_db"))
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", str(tmp_path / "embedding_cache.sqlite3"))
+    service = LLMAgentService(None, embedding_backend="fake", llm_backend="fake")
+    yield service
+    service.shutdown()
+
+
+class SlowChain:
+    def __init__(self):
+        self.calls = 0
+
+    async def ainvoke(self, prompt_vars):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        return AIMessage(content="shared answer", usage_metadata={"input_tokens": 100, "output_tokens": 10, "total_tokens": 110})
+
+
+def test_coalesced_answers_count_provider_tokens_once(service):
+    chain = SlowChain()
+    prompt_vars = {"context": "ctx", "input": "same question"}
+    input_tokens = RAG_LLM_TOKENS.labels("input")
+    output_tokens = RAG_LLM_TOKENS.labels("output")
+    answers = RAG_ANSWERS.labels("llm")
+    before = (input_tokens.value, output_tokens.value, answers.value)
+
+    async def run():
+        usages = [{"input_tokens": 50} for _ in range(5)]
+        results = await asyncio.gather(*(service._generate(1, chain, prompt_vars, None, usage) for usage in usages))
+        return results, usages
+
+    results, usages = asyncio.run(run())
+    assert chain.calls == 1 and results == ["shared answer"] * 5
+    # Every caller reports the answer's usage, but the provider was paid once
+    assert all(usage == {"input_tokens": 100, "output_tokens": 10} for usage in usages)
+    assert input_tokens.value - before[0] == 100
+    assert output_tokens.value - before[1] == 10
+    assert answers.value - before[2] == 5
@@ -0,0 +1,126 @@
+import asyncio
+
+from langchain_core.documents import Document
+
+from services.retrieval import RRF_K, hybrid_retrieve, reciprocal_rank_fusion
+from services.sparse_index import BM25Index, tokenize
+
+CHUNKS = {
+    "a": "The widget ships with a charger and a quick start guide.",
+    "b": "Replacement part SKU-1234 fits every widget made after 2020.",
+    "c": "Returns are accepted within 30 days of delivery.",
+    "d": "The widget charger takes about two hours to charge the widget.",
+}
+
+
+def _index() -> BM25Index:
+    index = BM25Index()
+    for chunk_id, text in CHUNKS.items():
+        index.add(chunk_id, text)
+    return index
+
+
+def test_codes_are_kept_whole_and_split():
+    assert tokenize("Order SKU-1234, v2.1") == ["order", "sku-1234", "sku", "1234", "v2.1", "v2", "1"]
+
+
+def test_code_matches_whole_and_by_parts():
+    index = _index()
+    assert index.search("SKU-1234", 2)[0][0] == "b"
+    assert index.search("sku 1234", 2)[0][0] == "b"
+
+
+def test_rare_term_outranks_common_one():
+    hits = _index().search("widget returns", 4)
+    # "returns" is in one chunk, "widget" in three
+    assert hits[0][0] == "c"
+    assert [score for _, score in hits] == sorted((score for _, score in hits), reverse=True)
+
+
+def test_search_returns_at_most_k_and_nothing_for_unknown_terms():
+    index = _index()
+    assert len(index.search("widget", 2)) == 2
+    assert index.search("refund", 4) == []
+    assert BM25Index().search("widget", 4) == []
+
+
+def test_add_replaces_a_chunk():
+    index = _index()
+    index.add("c", "Warranty claims need the original receipt.")
+    assert len(index) == 4
+    assert index.search("returns delivery", 4) == []
+    assert index.search("warranty", 4)[0][0] == "c"
+
+
+def test_remove_many_drops_chunks_and_their_terms():
+    index = _index()
+    index.remove_many(["b", "missing"])
+    assert len(index) == 3
+    assert index.search("SKU-1234", 4) == []
+    assert "sku-1234" not in index._postings
+    assert index._total_length == sum(len(tokenize(CHUNKS[i])) for i in "acd")
+
+
+def test_save_and_load_round_trip(tmp_path):
+    index = _index()
+    index.save(str(tmp_path))
+    loaded = BM25Index.load(str(tmp_path))
+    assert len(loaded) == len(index)
+    for query in ("widget charger", "SKU-1234", "returns"):
+        assert loaded.search(query, 4) == index.search(query, 4)
+
+
+def test_load_returns_none_without_a_valid_index(tmp_path):
+    assert BM25Index.load(str(tmp_path)) is None
+    (tmp_path / "bm25.json").write_text("{not json")
+    assert BM25Index.load(str(tmp_path)) is None
+
+
+def test_fusion_favours_ids_both_lists_agree_on():
+    fused = reciprocal_rank_fusion([(1.0, ["a", "b", "c"]), (1.0, ["d", "c", "e"])])
+    assert fused[0] == "c"
+    assert set(fused) == {"a", "b", "c", "d", "e"}
+
+
+def test_fusion_weights_tilt_the_order():
+    dense, sparse = ["a", "b"], ["b", "a"]
+    assert reciprocal_rank_fusion([(2.0, dense), (1.0, sparse)])[0] == "a"
+    assert reciprocal_rank_fusion([(1.0, dense), (2.0, sparse)])[0] == "b"
+
+
+def test_fusion_scores_by_rank_not_list_length():
+    # First place in a short list ties first place in a long one
+    fused = reciprocal_rank_fusion([(1.0, ["a"]), (1.0, ["b"] + [f"x{i}" for i in range(RRF_K)])])
+    assert set(fused[:2]) == {"a", "b"}
+    assert reciprocal_rank_fusion([]) == []
+
+
+class FakeVectorStore:
+    def __init__(self, chunks: dict, dense_order: list):
+        self.chunks = chunks
+        self.dense_order = dense_order
+        self.fetched = []
+
+    async def asimilarity_search(self, query: str, k: int) -> list:
+        return [Document(page_content=self.chunks[i], metadata={}, id=i) for i in self.dense_order[:k]]
+
+    def get(self, ids: list, include: list) -> dict:
+        self.fetched.extend(ids)
+        return {"ids": ids, "documents": [self.chunks[i] for i in ids], "metadatas": [None] * len(ids)}
+
+
+def test_hybrid_retrieve_fetches_sparse_only_hits_by_id():
+    store = FakeVectorStore(CHUNKS, dense_order=["a", "d"])
+    docs = asyncio.run(hybrid_retrieve(store, _index(), "SKU-1234", k=3))
+    # "b" ties "a" at first place; the dense list's order breaks the tie
+    assert [doc.id for doc in docs] == ["a", "b", "d"]
+    assert store.fetched == ["b"]
+    assert docs[1].page_content == CHUNKS["b"]
+
+
+def test_zero_weight_skips_a_retriever():
+    store = FakeVectorStore(CHUNKS, dense_order=["a", "d"])
+    docs = asyncio.run(hybrid_retrieve(store, _index(), "SKU-1234", k=3, dense_weight=0.0))
+    assert [doc.id for doc in docs] == ["b"]
+    docs = asyncio.run(hybrid_retrieve(store, _index(), "SKU-1234", k=3, sparse_weight=0.0))
+    assert [doc.id for doc in docs] == ["a", "d"]
@@ -0,0 +1,96 @@
+import asyncio
+import os
+
+import pytest
+
+from services.uploads import UnsupportedUploadType, UploadError, UploadTooLarge, receive_upload
+
+BOUNDARY = "test-boundary"
+
+
+class FakeRequest:
+    """Just what receive_upload reads from a Starlette request."""
+
+    def __init__(self, body: bytes, chunk_bytes: int = 7, content_type: str = f"multipart/form-data; boundary={BOUNDARY}"):
+        self.headers = {"content-type": content_type}
+        self._body = body
+        self._chunk_bytes = chunk_bytes
+
+    async def stream(self):
+        for start in range(0, len(self._body), self._chunk_bytes):
+            yield self._body[start:start + self._chunk_bytes]
+
+
+def multipart(*parts) -> bytes:
+    # parts are (field name, filename or None, content)
+    body = b""
+    for name, filename, content in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+        body += f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + content + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+def receive(request, directory, **kwargs):
+    kwargs.setdefault("max_bytes", 1024 * 1024)
+    kwargs.setdefault("chunk_bytes", 16)
+    return asyncio.run(receive_upload(request, "file", str(directory), **kwargs))
+
+
+def test_unsupported_extension_is_refused_before_writing(tmp_path):
+    request = FakeRequest(multipart(("file", "notes.docx", b"x" * 1000)))
+    with pytest.raises(UnsupportedUploadType, match=".docx"):
+        receive(request, tmp_path, extensions=(".pdf", ".txt"))
+    assert os.listdir(tmp_path) == []
+
+
+def test_extension_check_ignores_case(tmp_path):
+    request = FakeRequest(multipart(("file", "KB.TXT", b"hello")))
+    file_path, filename = receive(request, tmp_path, extensions=(".pdf", ".txt"))
+    assert filename == "KB.TXT" and file_path.endswith(".txt")
+
+
+def test_file_part_is_written_among_other_fields(tmp_path):
+    content = bytes(range(256)) * 40 + b"\r\n--not-the-boundary\r\n"
+    request = FakeRequest(multipart(("note", None, b"hello"), ("file", "kb.pdf", content), ("after", None, b"x")))
+    file_path, filename = receive(request, tmp_path)
+    assert filename == "kb.pdf" and file_path.endswith(".pdf")
+    with open(file_path, "rb") as f:
+        assert f.read() == content
+
+
+def test_upload_over_the_limit_is_abandoned(tmp_path):
+    request = FakeRequest(multipart(("file", "kb.txt", b"x" * 5000)))
+    with pytest.raises(UploadTooLarge):
+        receive(request, tmp_path, max_bytes=4096)
+    assert os.listdir(tmp_path) == []
+
+
+def test_upload_at_the_limit_is_accepted(tmp_path):
+    request = FakeRequest(multipart(("file", "kb.txt", b"x" * 4096)))
+    file_path, _ = receive(request, tmp_path, max_bytes=4096)
+    assert os.path.getsize(file_path) == 4096
+
+
+def test_truncated_body_is_an_error(tmp_path):
+    body = multipart(("file", "kb.txt", b"x" * 1000))
+    with pytest.raises(UploadError, match="ended before"):
+        receive(FakeRequest(body[:600]), tmp_path)
+    assert os.listdir(tmp_path) == []
+
+
+def test_missing_file_field_is_an_error(tmp_path):
+    request = FakeRequest(multipart(("file", None, b"not a file"), ("other", "kb.txt", b"x")))
+    with pytest.raises(UploadError, match="No file"):
+        receive(request, tmp_path)
+
+
+@pytest.mark.parametrize("content_type", ["application/json", "multipart/form-data"])
+def test_non_multipart_body_is_an_error(tmp_path, content_type):
+    with pytest.raises(UploadError, match="multipart/form-data"):
+        receive(FakeRequest(b"{}", content_type=content_type), tmp_path)
+
+
+def test_malformed_multipart_is_an_error(tmp_path):
+    body = f"--{BOUNDARY}\r\nthis header has no colon\r\n\r\ndata\r\n--{BOUNDARY}--\r\n".encode()
+    with pytest.raises(UploadError, match="not valid"):
+        receive(FakeRequest(body), tmp_path)